@@ -0,0 +1,100 @@
+"""
+Benchmark of the LimitedReader (file/upload) against the
+regular file object that tgbox gets for small files. Both
+are read through the tgbox encrypting stream (the same
+OpenPretender with AES and HMAC that .push_file() uses),
+chunk by chunk, as on upload. We print throughput and
+average peak of memory allocated by Python (tracemalloc)
+while one chunk is read and encrypted. For open() it
+includes the new bytes that every read() allocates.
+
+Needs the tgbox-cli installed (with dependencies), run
+it from the repository root:
+
+    python benchmarks/limited_reader.py [SIZE_MB] [FILE]
+
+If FILE is not specified, we will make temporary file of
+SIZE_MB (512 by default) with random data. Run it twice
+if you want to see results with warm page cache.
+"""
+
+import sys
+
+from hmac import HMAC
+from os import urandom
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from cli.config import tgbox
+from cli.commands.file.upload import LimitedReader
+
+# Size of chunk that tgbox reads on push
+CHUNK_SIZE = 524288
+
+
+async def consume(reader, size: int) -> tuple:
+    """Will encrypt all data and return (seconds, chunk peak)"""
+    stream = tgbox.tools.OpenPretender(
+        reader, tgbox.crypto.AESwState(urandom(32)),
+        HMAC(urandom(32), digestmod='sha256'), size
+    )
+    chunks, peaks = 0, 0
+
+    tracemalloc.start()
+    started = perf_counter()
+    try:
+        while True:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+
+            if not await stream.read(CHUNK_SIZE):
+                break
+
+            peaks += tracemalloc.get_traced_memory()[1] - current
+            chunks += 1
+
+        elapsed = perf_counter() - started
+    finally:
+        tracemalloc.stop()
+        reader.close()
+
+    return elapsed, peaks / max(chunks, 1)
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+
+    temp_file = None
+    if len(sys.argv) > 2:
+        file_path = sys.argv[2]
+    else:
+        temp_file = NamedTemporaryFile(suffix='.bin', delete=False)
+        with temp_file:
+            for _ in range(size_mb):
+                temp_file.write(urandom(1048576))
+        file_path = temp_file.name
+
+    size = Path(file_path).stat().st_size
+    print(f'File: {file_path} ({size/1048576:.0f}MB), chunk: {CHUNK_SIZE}')
+    try:
+        readers = (
+            ('open()', lambda: open(file_path, 'rb')),
+            ('LimitedReader', lambda: LimitedReader(file_path, 0, size, size))
+        )
+        for name, make_reader in readers:
+            elapsed, peak = tgbox.sync(consume(make_reader(), size))
+            print(
+                f'{name:>14}: {size/elapsed/1048576:8.1f} MB/s, '
+                f'{peak/1024:8.1f} KB allocated per chunk'
+            )
+    finally:
+        if temp_file:
+            Path(file_path).unlink()
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,12 @@ import click
 from pathlib import Path
 
 from ..group import cli_group
-from ..helpers import select_remotebox
+from ..helpers import select_remotebox, speed_limiter
 from ...tools.terminal import echo, ProgressBar
-from ...config import tgbox, TGBOX_CLI_SHOW_PASSWORD
+from ...config import (
+    tgbox, TGBOX_CLI_SHOW_PASSWORD,
+    TGBOX_CLI_DOWNLOAD_SPEED
+)
 
 
 @cli_group.command()
@@ -55,11 +58,19 @@ from ...config import tgbox, TGBOX_CLI_SHOW_PASSWORD
     '--scrypt-dklen', '-L', 'l', help='Scrypt key length',
     default=int(tgbox.defaults.Scrypt.DKLEN)
 )
+@click.option(
+    '--max-download-speed', default=TGBOX_CLI_DOWNLOAD_SPEED,
+    callback=speed_limiter,
+    help = (
+        'Max download speed per second, e.g "10MB". TGBOX_CLI_DOWNLOAD_SPEED '
+        'env variable by default, unlimited if unset')
+)
 @click.pass_context
 def box_clone(
         ctx, box_path, box_name,
         box_number, prefix, key,
-        phrase, s, n, p, r, l):
+        phrase, s, n, p, r, l,
+        max_download_speed):
     """
     Clone RemoteBox to LocalBox by your passphrase
     """
@@ -89,6 +100,11 @@ def box_clone(
         )
     drb = tgbox.sync(erb.decrypt(key=key))
 
+    if max_download_speed:
+        # Clone downloads Metadata of every file, and we
+        # can't count its bytes in progress_callback
+        max_download_speed.limit_client(drb.tc)
+
     dlb = tgbox.sync(tgbox.api.local.clone_remotebox(
         drb = drb,
         basekey = basekey,
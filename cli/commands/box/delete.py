@@ -6,6 +6,7 @@ from .close import box_close
 from ..group import cli_group
 from ..helpers import ctx_require
 from ...tools.terminal import echo
+from ...tools.cache import remove_box_caches
 from ...config import tgbox
 
 
@@ -44,6 +45,7 @@ def box_delete(ctx):
             ctx.invoke(box_close, number=ctx.obj.session['CURRENT_BOX']+1)
 
             echo('[C0b]Completely removing your LocalBox...[X] ', nl=False)
+            remove_box_caches(ctx.obj.dlb)
             tgbox.sync(ctx.obj.dlb.delete())
             echo('[G0b]Successful![X]')
 
@@ -2,14 +2,21 @@ import click
 
 from time import sleep
 from pathlib import Path
-from asyncio import get_event_loop, gather
+from asyncio import get_event_loop
 
 from ..group import cli_group
-from ..helpers import check_ctx
+from ..helpers import check_ctx, speed_limiter
 from ...tools.other import sync_async_gen
-from ...tools.terminal import echo, ProgressBar
+from ...tools.bundle import search_bundled, extract_members
+from ...tools.connections import SenderPool
+from ...tools.resume import ResumeRecord, make_hmac_state
+from ...tools.terminal import echo, ProgressBar, TransferProgress
+from ...tools.transfer import (
+    TransferPool, AdaptiveLimits,
+    RateLimiter, order_by_size
+)
 from ...tools.convert import filters_to_searchfilter
-from ...config import tgbox
+from ...config import tgbox, TGBOX_CLI_DOWNLOAD_SPEED
 
 
 def _launch(path: str, locate: bool, size: int) -> None:
@@ -51,37 +58,55 @@ def _download_preview(
 def process_regular_download(
         ctx, offset: int, redownload: bool, max_workers: int,
         max_bytes: int, hide_name: bool, use_slow_download: bool,
-        omit_hmac_check: bool, show: bool, locate: bool):
+        omit_hmac_check: bool, show: bool, locate: bool,
+        adaptive: AdaptiveLimits=None, limiter: RateLimiter=None,
+        progress: TransferProgress=None):
     """
     This generator processes regular (not Multipart) downloads.
     We push files into it via .send() method.
-    """
-    def _gather_helper(list_: list):
-        r = tgbox.sync(gather(*list_, return_exceptions=True))
 
-        exception = False
-        for flo in r:
-            if not flo:
-                continue
+    Downloads are made on the TransferPool, so new file
+    is started as soon as any running one is finished,
+    and .send() will block while pool has no free slot.
 
-            if isinstance(flo, Exception): # If download returned Exception
-                error = f'{type(flo).__name__}: {flo}'
-                echo(f'[R0b]x Can not download ID{drbf.id} due to "{error}"[X]')
-                exception = True
-            else:
-                # We need to close each File-like Object to
-                # ensure that all writes are final.
-                flo.close()
+    If adaptive is specified, it will manage limits
+    (max_workers and max_bytes) of the pool.
+
+    If limiter is specified, it will limit download speed.
 
-        if exception:
-            return
-        list_.clear()
+    If progress is specified, it will be used instead
+    of the per-file progress bar.
+    """
+    async def _download(drbf, outpath, download_coroutine, record, tracked):
+        try:
+            await download_coroutine
+        except Exception as e:
+            if progress: # File will not be finished
+                progress.untrack(tracked)
+
+            if adaptive:
+                adaptive.report_error(e)
+
+            error = f'{type(e).__name__}: {e}'
+            echo(f'[R0b]x Can not download ID{drbf.id} due to "{error}"[X]')
+
+            if record: # File will be closed, so blocks are written
+                outpath.close()
+                record.save()
+        else:
+            if record: # File is verified by HMAC
+                record.remove()
+        finally:
+            # We need to close each File-like Object to
+            # ensure that all writes are final.
+            outpath.close()
 
     loop = get_event_loop()
-    current_workers = max_workers
-    current_bytes = max_bytes
+    pool = TransferPool(max_workers, max_bytes)
+
+    if adaptive:
+        adaptive.attach(pool)
 
-    to_gather_files = []
     try:
         while True:
             drbf, file_name, outfile = yield
@@ -89,7 +114,25 @@ def process_regular_download(
             write_mode = 'wb'
             outfile_size = outfile.stat().st_size if outfile.exists() else 0
 
-            if not redownload and outfile.exists():
+            # Written blocks are recorded, so we can resume exactly
+            # from them. With offset file has only data after it,
+            # so we don't record such downloads.
+            record = None if offset else ResumeRecord(outfile, drbf.id, drbf.size)
+
+            if record and (redownload or not outfile.exists()):
+                record.remove()
+
+            if not redownload and record and record.load():
+                # Data after the last recorded block may be not
+                # written completely, so we drop it and resume
+                offset = record.resume_offset(0, drbf.size)
+
+                with open(outfile, 'ab') as f:
+                    f.truncate(offset)
+
+                write_mode = 'ab+'
+
+            elif not redownload and outfile.exists():
                 if outfile_size == drbf.size:
                     echo(f'[G0b]{str(outfile)} downloaded. Skipping...[X]')
                     continue
@@ -112,53 +155,73 @@ def process_regular_download(
                 echo('[R0b]Offset must be divisible by 4096 and by 524288.[X]')
                 continue
 
-            current_workers -= 1
-            current_bytes -= drbf.file_size
-
             outpath = open(outfile, write_mode)
 
             p_file_name = '<Filename hidden>' if hide_name\
                 else file_name
 
-            blocks_downloaded = 0 if not offset else offset // 524288
+            if progress: # One aggregated progress for all files
+                progress_callback = progress.track(p_file_name, drbf.size)
+            else:
+                blocks_downloaded = 0 if not offset else offset // 524288
 
-            download_coroutine = drbf.download(
-                outfile = outpath,
                 progress_callback = ProgressBar(
                     ctx.obj.enlighten_manager,
-                    p_file_name, blocks_downloaded).update,
+                    p_file_name, blocks_downloaded).update
+
+            tracked = progress_callback
+
+            if record:
+                progress_callback = record.track(0, outpath, progress_callback)
+
+            if adaptive: # We need to count bytes for --auto-workers
+                progress_callback = adaptive.track(progress_callback)
+
+            if limiter: # Will wait on every chunk if speed is exceeded
+                progress_callback = limiter.track(progress_callback)
+
+            download_coroutine = drbf.download(
+                outfile = outpath,
+                progress_callback = progress_callback,
 
                 offset = offset,
                 use_slow_download = use_slow_download,
                 omit_hmac_check = omit_hmac_check
             )
-            to_gather_files.append(download_coroutine)
-
+            # Will wait for a free slot (running downloads
+            # will progress meanwhile) and start download
+            tgbox.sync(pool.submit(
+                _download(drbf, outpath, download_coroutine, record, tracked),
+                drbf.file_size
+            ))
             if write_mode == 'ab+': # Partially downloaded write
                 offset = 0 # Reset offset for the next files
 
             if show or locate:
-                to_gather_files.append(loop.run_in_executor(
-                    None, lambda: _launch(outpath.name, locate, drbf.size))
-                )
-
-            check = (current_workers <= 0, current_bytes <= 0)
-            if any(check) and to_gather_files:
-                _gather_helper(to_gather_files)
-                current_workers = max_workers
-                current_bytes = max_bytes
+                loop.run_in_executor(None,
+                    _launch, outpath.name, locate, drbf.size)
+
     except GeneratorExit:
-        if to_gather_files:
-            _gather_helper(to_gather_files)
+        tgbox.sync(pool.join())
 
 
 def process_multipart_download(
-        ctx, multipart_offset: int, redownload: bool,
-        hide_name: bool, use_slow_download: bool,
-        omit_hmac_check: bool, show: bool, locate: bool):
+        ctx, multipart_offset: int, multipart_workers: int,
+        redownload: bool, hide_name: bool, use_slow_download: bool,
+        omit_hmac_check: bool, show: bool, locate: bool,
+        limiter: RateLimiter=None, progress: TransferProgress=None):
     """
     This generator processes Multipart downloads.
     We push files into it via .send() method.
+
+    Output file is preallocated and up to multipart_workers
+    parts are downloaded at the same time, each to its own
+    position. Finished parts are recorded by ResumeRecord.
+
+    If limiter is specified, it will limit download speed.
+
+    If progress is specified, it will be used instead
+    of the per-file progress bar.
     """
     # We will construct (format) dxbf only for first
     # multipart file part and skip its parts. Here
@@ -186,7 +249,7 @@ def process_multipart_download(
                 multipart_ignore.add(dlbf.id)
             parts.append(dlbf)
 
-        parts.sort(key=lambda d: d.cattrs['__mp_part'])
+        parts.sort(key=lambda d: tgbox.tools.bytes_to_int(d.cattrs['__mp_part']))
 
         total = tgbox.tools.bytes_to_int(parts[0].cattrs['__mp_total'])
         if len(parts) != total:
@@ -206,13 +269,24 @@ def process_multipart_download(
                f'but your offset is {multipart_offset}.[X]')
             continue
 
-        total_size = 0
+        parts = parts[multipart_offset or 0:]
+
+        # Position of every part in the output file
+        positions, total_size = [], 0
         for dlbf in parts:
+            positions.append(total_size)
             total_size += dlbf.size
 
-        outfile_size = outfile.stat().st_size if outfile.exists() else 0
+        # Finished parts are recorded, so we can resume
+        # download even if parts were fetched out of order
+        record = ResumeRecord(outfile, parts[0].id, total_size)
+
+        if redownload or not outfile.exists():
+            record.remove()
+
+        elif not record.load():
+            outfile_size = outfile.stat().st_size
 
-        if not redownload and outfile.exists():
             if outfile_size == total_size:
                 echo(f'[G0b]{str(outfile)} downloaded. Skipping...[X]')
                 continue
@@ -224,42 +298,179 @@ def process_multipart_download(
                     'offset or remove file from your computer. Skipping...[X]')
                 continue
 
-            csize = 0
-            for multipart_offset, dlbf in enumerate(parts):
-                if (csize + dlbf.size) == outfile_size:
-                    multipart_offset += 1
-                    break
+            # File was partially downloaded part by part (without
+            # record), so all parts that fit into it are finished
+            # and the last one is written up to the file end
+            for i, dlbf in enumerate(parts):
+                if outfile_size > total_size:
+                    break # This is some other file, start over
+
+                if positions[i] + dlbf.size <= outfile_size:
+                    record.parts.add(i)
+
+                elif positions[i] < outfile_size:
+                    record.written(i, outfile_size - positions[i], dlbf.size)
+
+        left = [i for i in range(len(parts)) if i not in record.parts]
+        record.save()
+
+        # File is preallocated, so every part can be
+        # written at its own position at any moment
+        with open(outfile, 'r+b' if outfile.exists() else 'wb') as f:
+            f.truncate(total_size)
+
+        drbfs = {}
+        if left: # All parts will be fetched by a few requests
+            remote_files = ctx.obj.drb.files(ids=[parts[i].id for i in left])
+
+            for drbf in sync_async_gen(remote_files):
+                drbfs[drbf.id] = drbf
+
+        async def _download_part(i, drbf, offset, progress_callback):
+            try:
+                with open(outfile, 'r+b') as part_file:
+                    if offset and not omit_hmac_check:
+                        # tgbox can't read part from the middle of
+                        # our file, so we make HMAC state for it
+                        hmac_state = await loop.run_in_executor(None,
+                            make_hmac_state, drbf, part_file, positions[i], offset)
+                    else:
+                        hmac_state = None
+
+                    part_file.seek(positions[i] + offset)
+
+                    # Written blocks are recorded, so we can
+                    # resume from them if download is stopped
+                    callback = record.track(i, part_file, progress_callback)
+
+                    if limiter: # Will wait on every chunk if speed is exceeded
+                        callback = limiter.track(callback)
+
+                    await drbf.download(
+                        outfile = part_file,
+                        progress_callback = callback,
+
+                        offset = offset,
+                        hmac_state = hmac_state,
+                        use_slow_download = use_slow_download,
+                        omit_hmac_check = omit_hmac_check
+                    )
+            except Exception as e:
+                if progress: # Part will not be finished
+                    progress.untrack(progress_callback)
+
+                error = f'{type(e).__name__}: {e}'
+                echo(f'[R0b]x Can not download ID{drbf.id} due to "{error}"[X]')
 
-                if (csize + dlbf.size) > outfile_size:
-                    with open(outfile, 'ab') as f:
-                        f.truncate(csize)
-                    break
+                record.save() # File is closed, so blocks are written
+                return
 
-                csize += dlbf.size
+            record.mark(i)
 
-        outpath = open(outfile, 'ab+')
+            if (show or locate) and i == 0:
+                loop.run_in_executor(None,
+                    _launch, str(outfile), locate, total_size)
 
-        if show or locate:
-            launch_coro = loop.run_in_executor(None,
-                lambda: _launch(outpath.name, locate, total_size)
-            )
-            loop.create_task(launch_coro)
+        pool = TransferPool(
+            max_workers = multipart_workers,
+            max_bytes = multipart_workers * max(d.size for d in parts)
+        )
+        for i in left:
+            drbf = drbfs.get(parts[i].id)
+
+            if not drbf:
+                echo(
+                    f'[R0b]x There is no part ID{parts[i].id} of "{file_name}" '
+                     'in RemoteBox. Skipping this part.[X]')
+                continue
 
-        for dlbf in parts[multipart_offset:]:
             # File name that will be displayed on Progressbar
-            p_file_name = '<Filename hidden>' if hide_name else dlbf.file_name
-            drbf = tgbox.sync(ctx.obj.drb.get_file(dlbf.id))
+            p_file_name = '<Filename hidden>' if hide_name else parts[i].file_name
+            offset = record.resume_offset(i, parts[i].size)
 
-            download_coroutine = drbf.download(
-                outfile = outpath,
-                progress_callback = ProgressBar(
-                    ctx.obj.enlighten_manager,
-                    p_file_name, 0).update,
+            if progress:
+                progress_callback = progress.track(p_file_name, parts[i].size)
+            else:
+                progress_callback = ProgressBar(ctx.obj.enlighten_manager,
+                    p_file_name, offset // 524288).update
 
-                use_slow_download = use_slow_download,
-                omit_hmac_check = omit_hmac_check
-            )
-            tgbox.sync(download_coroutine)
+            tgbox.sync(pool.submit(
+                _download_part(i, drbf, offset, progress_callback),
+                parts[i].size - offset
+            ))
+        tgbox.sync(pool.join())
+
+        if len(record.parts) == len(parts) and outfile.stat().st_size == total_size:
+            record.remove() # All parts are verified by HMAC
+        else:
+            echo(
+                f'[Y0b]{str(outfile)} is not fully downloaded. Run '
+                 'this command again to download parts left.[X]')
+
+def _download_bundled(
+        ctx, sf, out: Path, hide_folder: bool, ignore_file_path: bool,
+        redownload: bool, limiter: RateLimiter=None,
+        progress: TransferProgress=None):
+    """
+    This function will download files packed into bundles. All
+    matched members of one bundle are extracted from a single
+    ranged download of this bundle.
+    """
+    bundles = {} # Bundle ID: [dlbf, [(member, outfile), ...]]
+
+    for dlbf, member in sync_async_gen(search_bundled(ctx.obj.dlb, sf)):
+        downloads = out or Path(dlbf.defaults.DOWNLOAD_PATH) / 'Files'
+
+        if ignore_file_path:
+            outfile = downloads / member.name
+        else:
+            if hide_folder:
+                file_path = tgbox.defaults.DEF_UNK_FOLDER
+            else:
+                file_path = member.path.replace('\\', '/').rsplit('/', 1)[0]
+
+            file_path = tgbox.tools.make_safe_file_path(file_path)
+            outfile = downloads / file_path / member.name.lstrip('/\\')
+
+        if not redownload and outfile.exists():
+            if outfile.stat().st_size == member.length:
+                echo(f'[G0b]{str(outfile)} downloaded. Skipping...[X]')
+                continue
+
+        outfile.parent.mkdir(exist_ok=True, parents=True)
+        bundles.setdefault(dlbf.id, [dlbf, []])[1].append((member, outfile))
+
+    for dlbf, targets in bundles.values():
+        drbf = tgbox.sync(ctx.obj.drb.get_file(dlbf.id))
+
+        if not drbf:
+            echo(
+                f'[Y0b]There is no bundle with ID={dlbf.id} in '
+                 'RemoteBox. Skipping.[X]')
+            continue
+
+        p_name = f'{len(targets)} file(s) from {dlbf.file_name}'
+
+        if progress:
+            progress_callback = progress.track(p_name)
+        else:
+            progress_callback = ProgressBar(
+                ctx.obj.enlighten_manager, p_name).update
+
+        tracked = progress_callback
+
+        if limiter:
+            progress_callback = limiter.track(progress_callback)
+
+        try:
+            tgbox.sync(extract_members(drbf, targets, progress_callback))
+        except Exception as e:
+            if progress: # Bundle will not be finished
+                progress.untrack(tracked)
+
+            echo(
+                f'[R0b]x Can not download from bundle ID{dlbf.id} '
+                f'due to "{type(e).__name__}: {e}"[X]')
 
 @cli_group.command()
 @click.argument('filters', nargs=-1)
@@ -321,6 +532,12 @@ def process_multipart_download(
         'THIRD part to FIVE part, skipping First (0) and Second (1).'
     )
 )
+@click.option(
+    '--multipart-workers', default=4, type=click.IntRange(1,10),
+    help = (
+        'Max amount of Multipart file parts we will download at the '
+        'same time. Parts are written to their own place, default=4')
+)
 @click.option(
     '--split-multipart', '-m', is_flag=True,
     help='If specified, will download all Multipart file parts separately',
@@ -338,13 +555,58 @@ def process_multipart_download(
     type=click.IntRange(1000000, 1000000000),
     help='Max amount of bytes downloaded at the same time, default=200000000',
 )
+@click.option(
+    '--auto-workers', is_flag=True,
+    help = (
+        'If specified, will tune --max-workers and --max-bytes at '
+        'runtime by measured throughput, FloodWaits and errors. '
+        'Specified values are used as a start')
+)
+@click.option(
+    '--max-download-speed', default=TGBOX_CLI_DOWNLOAD_SPEED,
+    callback=speed_limiter,
+    help = (
+        'Max download speed per second of all files in total, e.g "10MB". '
+        'TGBOX_CLI_DOWNLOAD_SPEED env variable by default, unlimited if unset')
+)
+@click.option(
+    '--bundled', '-b', is_flag=True,
+    help = (
+        'If specified, will download files packed into bundles '
+        '(see file-upload --bundle-small). Only scope, file_name, '
+        'file_path, min_size and max_size filters are supported')
+)
+@click.option(
+    '--order', type=click.Choice(['largest', 'smallest']),
+    help = (
+        'Download "largest" files first (less time with idle workers at '
+        'the end) or "smallest" first (fast feedback). Files are ordered '
+        'within a window of 1000, so search is not loaded in memory')
+)
+@click.option(
+    '--connections', type=click.IntRange(1,100),
+    help = (
+        'Max amount of connections per Telegram data center that will '
+        'be kept open and shared by all files. Every file gets up to 20 '
+        'of them. By default, every file opens and closes its own')
+)
+@click.option(
+    '--progress', 'progress_mode', default='aggregate',
+    type=click.Choice(['aggregate', 'files', 'plain']),
+    help = (
+        'How to show progress: "aggregate" shows total of the whole '
+        'download and top active files, "files" shows bar per file and '
+        '"plain" prints summary line sometimes (for logs). "aggregate" '
+        'is printed as "plain" if output is not a terminal')
+)
 @click.pass_context
 def file_download(
         ctx, filters, preview, show, locate,
         hide_name, hide_folder, out, ignore_file_path,
         force_remote, redownload, use_slow_download,
-        offset, multipart_offset, split_multipart,
-        omit_hmac_check, max_workers, max_bytes):
+        offset, multipart_offset, multipart_workers, split_multipart,
+        omit_hmac_check, max_workers, max_bytes, auto_workers,
+        max_download_speed, bundled, order, connections, progress_mode):
     """Download files by selected filters
 
     \b
@@ -426,7 +688,7 @@ def file_download(
         You can use both, the ++include and
         ++exclude (+i, +e) in one command.
     """
-    if preview and not force_remote:
+    if preview and not force_remote and not bundled:
         check_ctx(ctx, dlb=True)
     else:
         check_ctx(ctx, dlb=True, drb=True)
@@ -439,16 +701,58 @@ def file_download(
         echo(f'[R0b]Filter "{e.args[0]}" doesn\'t exists[X]')
         return
 
+    if connections and not preview:
+        # Connections will be reused between files
+        senders = SenderPool(connections)
+
+        if not senders.install():
+            echo(
+                '[Y0b]Installed tgbox is not supported by --connections, '
+                'connections will not be reused.[X]')
+    else:
+        senders = None
+
+    if progress_mode != 'files' and not preview:
+        progress = TransferProgress(ctx.obj.enlighten_manager,
+            'Download', plain=(progress_mode == 'plain'))
+    else:
+        progress = None
+
+    if bundled:
+        _download_bundled(
+            ctx, sf, out, hide_folder, ignore_file_path,
+            redownload, max_download_speed, progress)
+
+        if senders:
+            tgbox.sync(senders.close())
+
+        if progress:
+            progress.close()
+        return
+
     box = ctx.obj.drb if force_remote else ctx.obj.dlb
     to_download = box.search_file(sf)
 
+    if order and not preview:
+        to_download = order_by_size(to_download,
+            size = lambda dxbf: dxbf.size,
+            largest_first = (order == 'largest')
+        )
+
+    if auto_workers and not preview:
+        adaptive = AdaptiveLimits('download', max_workers, max_bytes)
+    else:
+        adaptive = None
+
     process_r_download = process_regular_download(
         ctx, offset, redownload, max_workers, max_bytes, hide_name,
-        use_slow_download, omit_hmac_check, show, locate
+        use_slow_download, omit_hmac_check, show, locate, adaptive,
+        max_download_speed, progress
     )
     process_m_download = process_multipart_download(
-        ctx, multipart_offset, redownload, hide_name,
-        use_slow_download, omit_hmac_check, show, locate
+        ctx, multipart_offset, multipart_workers, redownload, hide_name,
+        use_slow_download, omit_hmac_check, show, locate,
+        max_download_speed, progress
     )
     next(process_r_download) # Init Generator
     next(process_m_download) # Init Generator
@@ -513,6 +817,19 @@ def file_download(
                 continue
             dxbf = drbf
 
+        if dxbf.cattrs and dxbf.cattrs.get('__ref_id'):
+            # File was uploaded by file-upload --dedupe as a
+            # reference to other Box file with same content
+            ref_id = tgbox.tools.bytes_to_int(dxbf.cattrs['__ref_id'])
+            ref_drbf = tgbox.sync(ctx.obj.drb.get_file(ref_id))
+
+            if not ref_drbf:
+                echo(
+                    f'[R0b]x File ID{dxbf.id} is a reference to ID{ref_id}, '
+                     'but there is no such file in RemoteBox. Skipping.[X]')
+                continue
+            dxbf = ref_drbf
+
         if multipart_file and not split_multipart:
             process_m_download.send((dxbf, file_name, outfile))
         else:
@@ -520,3 +837,12 @@ def file_download(
 
     process_r_download.close()
     process_m_download.close()
+
+    if adaptive:
+        adaptive.close()
+
+    if senders:
+        tgbox.sync(senders.close())
+
+    if progress:
+        progress.close()
@@ -7,7 +7,11 @@ from datetime import datetime
 from ..group import cli_group
 from ..helpers import check_ctx
 from ...tools.terminal import echo
-from ...tools.other import format_dxbf, format_dxbf_multipart, sync_async_gen
+from ...tools.other import (
+    format_dxbf, format_dxbf_multipart,
+    format_bundle_member, sync_async_gen
+)
+from ...tools.bundle import search_bundled
 from ...tools.convert import format_bytes, filters_to_searchfilter
 from ...config import tgbox, TGBOX_CLI_NOCOLOR
 
@@ -42,10 +46,17 @@ from ...config import tgbox, TGBOX_CLI_NOCOLOR
     '--split-multipart', '-m', is_flag=True,
     help='If specified, will not collect Multipart file in one entry',
 )
+@click.option(
+    '--bundled', '-b', is_flag=True,
+    help = (
+        'If specified, will search for files packed into bundles '
+        '(see file-upload --bundle-small). Only scope, file_name, '
+        'file_path, min_size and max_size filters are supported')
+)
 @click.pass_context
 def file_search(
         ctx, filters, force_remote, non_interactive, non_imported,
-        upend, bytesize_total, fetch_count, split_multipart):
+        upend, bytesize_total, fetch_count, split_multipart, bundled):
     """List files by selected filters
 
     \b
@@ -153,6 +164,18 @@ def file_search(
 
     box = ctx.obj.drb if force_remote else ctx.obj.dlb
 
+    if bundled:
+        sgen = sync_async_gen(search_bundled(ctx.obj.dlb, sf))
+        sgen = (format_bundle_member(*bundled_file) for bundled_file in sgen)
+
+        if non_interactive:
+            for formatted in sgen:
+                echo(formatted, nl=False)
+            echo('')
+        else:
+            click.echo_via_pager(sgen, color=(False if TGBOX_CLI_NOCOLOR else None))
+        return
+
     if non_imported:
         iter_over = ctx.obj.drb.search_file(
             sf=sf, reverse=True,
@@ -268,7 +291,7 @@ def file_search(
                             multipart_ignore.add(dlbf.id)
                         parts.append(dlbf)
 
-                    parts.sort(key=lambda d: d.cattrs['__mp_part'])
+                    parts.sort(key=lambda d: tgbox.tools.bytes_to_int(d.cattrs['__mp_part']))
                     yield format_dxbf_multipart(parts)
                 else:
                     yield format_dxbf(bfi)
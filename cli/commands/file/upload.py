@@ -1,14 +1,17 @@
 import click
 
-from re import search as re_search
-from os.path import getsize
+from re import compile as re_compile
+from os.path import getsize, join as path_join
 from hashlib import sha256
-from asyncio import gather
+from asyncio import get_running_loop, sleep, shield
+from time import monotonic
 from copy import deepcopy
+from functools import partial
 from pathlib import Path
 from os import SEEK_SET
 from math import ceil
-from io import IOBase
+from typing import Callable, Optional
+from io import IOBase, BytesIO
 
 from filetype import guess as filetype_guess
 
@@ -17,16 +20,53 @@ from ...tools.convert import (
     format_bytes
 )
 from ..group import cli_group
-from ..helpers import ctx_require
-from ...tools.other import sync_async_gen
-from ...tools.terminal import echo, ProgressBar
-from ...config import tgbox
+from ..helpers import ctx_require, speed_limiter, bytesize
+from ...tools.terminal import echo, ProgressBar, TransferProgress
+from ...tools.transfer import (
+    TransferPool, AdaptiveLimits,
+    RemoteBoxPool, order_by_size
+)
+from ...tools.cache import (
+    BoxCache, UploadJournal,
+    ContentIndex, FingerprintFilter
+)
+from ...tools.walk import walk_tree, walk_paths, IgnoreMatcher, IGNORE_FILE
+from ...tools.watch import TreeWatcher
+from ...tools.bundle import BundleWriter, BUNDLE_VERSION
+from ...tools.preview import PreviewMaker
+from ...tools.connections import SenderPool
+from ...config import tgbox, TGBOX_CLI_UPLOAD_SPEED, API_ID, API_HASH
+
+
+# By default, files are split into Multipart parts of the max
+# size that account can upload (see file_upload), so we have less
+# messages & metadata requests. This (much smaller) size is used
+# for the stream (e.g stdin), as its parts are kept in memory
+# until upload, and for the --force-multipart
+MULTIPART_PART_SIZE = 256_000_000
+
+# Parts are hashed by blocks of this size, so part can be of
+# any size and will never be fully read into memory
+MULTIPART_HASH_BLOCK = 64_000_000
+
+# Version of the Multipart files, '__mp_ver' CAttr
+MULTIPART_VERSION = b'\x01'
+
+# Value of the '__mp_previous' CAttr for parts that were uploaded
+# concurrently and still wait for _link_multipart() to set the
+# actual ID of the previous part. Downloads order parts by
+# '__mp_part', so such file is still readable if interrupted.
+# Also used as '__mp_total' of parts uploaded from the stream,
+# as we don't know amount of parts until stream is ended.
+MULTIPART_UNLINKED = b'unlinked'
 
+# Regular files of this size and bigger will be read to the
+# reused buffer (see LimitedReader). On smaller ones it's not worth
+BUFFERED_READ_MIN_SIZE = 8_000_000
 
-# Size of one block of Multipart file upload. We will compute
-# sha256 over it, so it must be fairly small. MUST BE DIVISIBLE
-# by 64_000_000 (64MB)
-MULTIPART_BLOCK_SIZE = 256_000_000
+# Files smaller than this will not be deduplicated. Reference
+# is a Box file too, so we will not save anything on them
+DEDUPE_MIN_SIZE = 1_000_000
 
 
 class LimitedReader:
@@ -35,10 +75,25 @@ class LimitedReader:
     read() for the Tgbox .push_file() method. Here
     we can specify start and stop position to read
     from.
+
+    Data is read with readinto() to the one reused
+    buffer, and read() returns memoryview of it, so we
+    don't allocate new bytes on every chunk. Returned
+    memoryview is valid only until the next read(), so
+    it must be consumed at once (tgbox encrypts it).
+    readinto() is also supported.
+
+    If file is truncated while we read it, read() will
+    simply return less bytes (as a regular file does).
+
+    If hash_reads is True, we will also compute the
+    sha256 over all bytes read from the start_pos, so
+    the data is read from disk only once.
     """
     def __init__(
             self, file_path: str, start_pos: int,
-            stop_pos: int, actual_size: int):
+            stop_pos: int, actual_size: int,
+            hash_reads: bool=False):
 
         self._file_path = file_path
         self._start_pos = start_pos
@@ -48,8 +103,14 @@ class LimitedReader:
         self._flo = open(file_path,'rb')
         self._flo.seek(start_pos, 0)
 
+        self._position = start_pos
         self._available = stop_pos - start_pos
 
+        self._hash_reads = hash_reads
+        self._hash = sha256() if hash_reads else None
+
+        self._buffer = None # memoryview of reused bytearray
+
     def __del__(self):
         self.close()
 
@@ -61,21 +122,63 @@ class LimitedReader:
     def name(self) -> str:
         return self._file_path
 
+    @property
+    def start_pos(self) -> int:
+        return self._start_pos
+
+    @property
+    def hash(self):
+        """
+        sha256 state over bytes read from the start_pos
+        or None if hash_reads is False or if reader was
+        seeked to the position other than start.
+        """
+        return self._hash
+
+    def _amount(self, size: int) -> int:
+        if size < 0 or self._available < size:
+            return max(self._available, 0)
+        return size
+
+    def _readinto(self, buffer: memoryview) -> int:
+        total = 0
+        # readinto() of file can return less than requested
+        while total < len(buffer):
+            read = self._flo.readinto(buffer[total:])
+            if not read: # File ended (e.g it was truncated)
+                self._available = total
+                break
+            total += read
+
+        self._available -= total
+        self._position += total
+
+        if self._hash is not None:
+            self._hash.update(buffer[:total])
+
+        return total
+
     def read(self, size: int=-1):
-        if self._available <= 0:
+        amount = self._amount(size)
+        if not amount:
             return b''
 
-        if size < 0:
-            amount = self._available
-            self._available = 0
-        else:
-            if self._available < size:
-                amount = self._available
-            else:
-                amount = size
+        if self._buffer is None or len(self._buffer) < amount:
+            self._buffer = memoryview(bytearray(amount))
+
+        data = self._buffer[:self._readinto(self._buffer[:amount])]
+
+        if size < 0 or len(data) < size:
+            # The last chunk of file will be padded by the
+            # tgbox with concatenation, so it must be bytes
+            data = data.tobytes()
+
+        return data
 
-        self._available -= amount
-        return self._flo.read(amount)
+    def readinto(self, buffer) -> int:
+        """Will read up to len(buffer) bytes into the buffer"""
+        buffer = memoryview(buffer).cast('B')
+        return self._readinto(buffer[:self._amount(len(buffer))])
 
     def seek(self, cookie: int, whence: int=SEEK_SET, /):
         """
@@ -98,203 +201,1481 @@ class LimitedReader:
         else:
             start_pos = self._start_pos + cookie
 
-        self._available = self._stop_pos - self._start_pos
+        if self._hash_reads:
+            # Bytes before the new position will be never read
+            # again, so we can hash only from the start_pos
+            if start_pos == self._start_pos:
+                self._hash = sha256()
+            else:
+                self._hash = None
+
+        self._position = start_pos
+        self._available = self._stop_pos - start_pos
         return self._flo.seek(start_pos, whence)
 
     def close(self):
+        self._buffer = None
         self._flo.close()
 
+class StreamPart(BytesIO):
+    """
+    This class is an in-memory block of the stream (e.g
+    stdin) that we upload as a file or Multipart part.
+    """
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+
+        self.name = name
+        self._size = len(data)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+def _hash_file(file_path: Path) -> bytes:
+    """This function will compute sha256 over the whole file"""
+    file_hash = sha256()
+
+    with open(file_path, 'rb') as f:
+        while (block := f.read(8_000_000)):
+            file_hash.update(block)
+
+    return file_hash.digest()
+
+class _DedupeEntry:
+    """Local file that was checked by the Deduplicator"""
+    def __init__(self, path: Path, stat, result):
+        self.path = path
+        self.stat = stat
+
+        self.hash = None # sha256 of the file, if known
+        self.hashing = None # Future of the hash, if in progress
+
+        # Future of the Box file ID which has content of this
+        # file (or None if upload is failed). For duplicates
+        # it's the ID of original, not of the reference
+        self.result = result
+
+class Deduplicator:
+    """
+    This class finds local files with the same content as
+    files that are already in the Box or uploaded in this
+    run. Duplicates are then reported or pushed as small
+    references (with '__ref_id' CAttr) to the original.
+
+    Files with the same inode (hardlinks) are collapsed
+    without any reads. Other files are hashed only if Box
+    (see ContentIndex) or this run has file of the same
+    size, so files with unique size cost nothing: they
+    are hashed from the same reads that feed encryption.
+
+    Hashing is done in executor, so files are checked in
+    parallel, as every check runs inside of the pool task.
+    """
+    def __init__(self, index: ContentIndex, mode: str):
+        self.index = index
+        self.mode = mode # 'link' or 'report'
+
+        self.duplicates = 0
+        self.saved_bytes = 0
+
+        self._inodes = {} # (st_dev, st_ino) -> _DedupeEntry
+        self._sizes = {} # File size -> [_DedupeEntry, ...]
+
+    async def hash(self, entry: _DedupeEntry) -> bytes:
+        """Will return sha256 of the entry file, hashing it if needed"""
+        if entry.hash:
+            return entry.hash
+
+        if not entry.hashing:
+            entry.hash = self.index.local_hash(entry.path, entry.stat)
+            if entry.hash:
+                return entry.hash
+
+            entry.hashing = get_running_loop().run_in_executor(
+                None, _hash_file, entry.path)
+
+        # Many files can wait for the same hash, and we don't
+        # want to cancel hashing if one of them is cancelled
+        content_hash = await shield(entry.hashing)
+
+        if not entry.hash:
+            entry.hash = content_hash
+            self.index.set_local_hash(entry.path, entry.stat, content_hash)
+
+        return entry.hash
+
+    async def check(self, path: Path, stat) -> tuple:
+        """
+        Will return (_DedupeEntry, ID of the Box file with
+        the same content or None). Caller should always
+        report result with .uploaded() after this call.
+
+        We only wait for files that were checked before,
+        so checks of identical files will never deadlock.
+        """
+        entry = _DedupeEntry(path, stat, get_running_loop().create_future())
+
+        earlier = self._sizes.setdefault(stat.st_size, [])[:]
+        self._sizes[stat.st_size].append(entry)
+
+        # st_ino is zero on systems where it's not supported
+        inode = (stat.st_dev, stat.st_ino) if stat.st_ino else None
+        hardlink = self._inodes.setdefault(inode, entry) if inode else entry
+
+        if hardlink is not entry:
+            file_id = await shield(hardlink.result)
+            if file_id:
+                return entry, file_id
+
+        if not earlier and not self.index.has_size(stat.st_size):
+            return entry, None # Nothing to compare with
+
+        content_hash = await self.hash(entry)
+
+        if (file_id := self.index.get(content_hash)):
+            return entry, file_id
+
+        for other in earlier:
+            if await self.hash(other) == content_hash:
+                file_id = await shield(other.result)
+                if file_id:
+                    return entry, file_id
+
+        return entry, None
+
+    def uploaded(self, entry: _DedupeEntry, file_id: Optional[int]):
+        """Will record ID of the Box file with content of entry"""
+        if file_id and entry.hash:
+            self.index.add(entry.hash, entry.stat.st_size, file_id)
+
+        if not entry.result.done():
+            entry.result.set_result(file_id)
+
+def _compile_filters(filters, mime_cache=None):
+    """
+    This function will compile SearchFilter into predicate
+    for local files: callable(current_path, cp_stat=None),
+    which will return True if File matches against filters.
+
+    All patterns are prepared only once, and checks are
+    ordered from the cheapest to the most expensive: by
+    name, by path, by stat and only then by MIME type
+    (we need to read a File to guess it).
+
+    If mime_cache (dict-like) is specified, guessed MIME
+    types will be stored in it, so we will not read File
+    again while it's unchanged.
+    """
+    # Will use Regex Search if 're' is included in Filters, "In" otherwise.
+    if filters.in_filters['re']:
+        make_matcher = lambda pattern: re_compile(pattern).search
+    else:
+        make_matcher = lambda pattern: lambda string: pattern in string
+
+    def string_check(patterns, include):
+        matchers = tuple(make_matcher(p) for p in patterns)
+
+        def check(string):
+            # Include filter needs any pattern to match, while
+            # exclude filter will reject File if any matched
+            return any(m(string) for m in matchers) == include
+        return check
+
+    def range_check(attr, bound, is_min, include):
+        def check(cp_stat):
+            value = getattr(cp_stat, attr)
+            in_range = value >= bound if is_min else value <= bound
+            return in_range == include
+        return check
+
+    name_checks, path_checks, stat_checks, mime_checks = [], [], [], []
+
+    for include, filter in ((True, filters.in_filters), (False, filters.ex_filters)):
+        if filter['file_name']:
+            name_checks.append(string_check(filter['file_name'], include))
+
+        if filter['file_path']:
+            path_checks.append(string_check(filter['file_path'], include))
+
+        if filter['mime']:
+            mime_checks.append(string_check(filter['mime'], include))
+
+        # Only the last specified value of these filters is used
+        for key, attr, is_min in (
+                ('min_time', 'st_mtime', True), ('max_time', 'st_mtime', False),
+                ('min_size', 'st_size', True), ('max_size', 'st_size', False)):
+            if filter[key]:
+                stat_checks.append(range_check(
+                    attr, filter[key][-1], is_min, include))
+
+    def guess_mime(current_path: Path, cp_stat) -> str:
+        if mime_cache is None:
+            file_mime = filetype_guess(current_path)
+            return file_mime.mime if file_mime else ''
+
+        cache_key = str(current_path)
+        cached = mime_cache.get(cache_key)
+
+        if cached and cached[:2] == (cp_stat.st_size, cp_stat.st_mtime_ns):
+            return cached[2]
+
+        file_mime = filetype_guess(current_path)
+        file_mime = file_mime.mime if file_mime else ''
+
+        mime_cache[cache_key] = (cp_stat.st_size, cp_stat.st_mtime_ns, file_mime)
+        return file_mime
+
+    def check_filters(current_path: Path, cp_stat=None):
+        if not all(check(current_path.name) for check in name_checks):
+            return False
+
+        if path_checks: # File absolute Path
+            abs_path = str(current_path.absolute())
+
+            if not all(check(abs_path) for check in path_checks):
+                return False
+
+        try:
+            if stat_checks or (mime_checks and mime_cache is not None):
+                cp_stat = cp_stat or current_path.stat()
+
+            if not all(check(cp_stat) for check in stat_checks):
+                return False
+
+            if mime_checks:
+                file_mime = guess_mime(current_path, cp_stat)
+
+                if not all(check(file_mime) for check in mime_checks):
+                    return False
+
+        except (FileNotFoundError, PermissionError, OSError) as e:
+            echo(f'[R0b]x {e}. Skipping...[X]')
+            return
+
+        return True # File matches against the filters
+
+    return check_filters
+
+async def _get_file_by_path(ctx, file_path, fingerprints=None):
+    """
+    This function will return DecryptedLocalBoxFile by its
+    path in the Box or None. If fingerprints (FingerprintFilter)
+    is specified, LocalBox will be requested only if file
+    may be in the Box, i.e on probable hit of the filter.
+    """
+    fingerprint = tgbox.tools.make_file_fingerprint(
+        mainkey = ctx.obj.dlb.mainkey,
+        file_path = str(file_path)
+    )
+    if fingerprints is not None and fingerprint not in fingerprints:
+        return None
+
+    return await ctx.obj.dlb.get_file(fingerprint=fingerprint)
+
+async def _get_push_action(
+        ctx, file, file_path, cattrs, force_update,
+        no_update, no_thumb, is_multipart, on_uploaded=None,
+        adaptive=None, limiter=None, fingerprints=None,
+        remote_boxes=None, progress_callback=None
+    ):
+    """Helper-function for the .push_file() coroutine"""
+
+    dlbf = await _get_file_by_path(ctx, file_path, fingerprints)
+
+    # New files can be pushed by any of accounts, but updated
+    # can be only by the Box owner, as we edit its message
+    push_file = remote_boxes.push_file if remote_boxes else ctx.obj.drb.push_file
+
+    if isinstance(file, (LimitedReader, StreamPart)):
+        file_size = file.size
+    else:
+        file_size = getsize(file)
+
+    # Standard file upload if dlbf is not exists (from scratch)
+    if not dlbf and not force_update:
+        file_action = (push_file, {})
+
+    # File re-uploading (or updating) if file size differ
+    elif is_multipart or (force_update or not no_update and\
+        dlbf and dlbf.size != file_size):
+            # If 'is_multipart' and file was sent here, it means that
+            # checksums differ, and we should omit checking by file
+            # size, as it will be same.
+
+            if not dlbf: # Wasn't uploaded before
+                file_action = (push_file, {})
+            else:
+                drbf = await ctx.obj.drb.get_file(dlbf.id)
+                file_action = (ctx.obj.drb.update_file, {'rbf': drbf})
+    else:
+        # Ignore upload if file exists and wasn't changed
+        name = getattr(file, 'name', file)
+        echo(f'[Y0b]| File {name} is already uploaded. Skipping...[X]')
+
+        if on_uploaded:
+            on_uploaded(dlbf.id)
+        return
+
+    if dlbf and dlbf.cattrs:
+        # Previous version of file can be a reference made
+        # by the --dedupe, but here we push file data
+        dlbf.cattrs.pop('__ref_id', None)
+
+    if cattrs is None: # CAttrs not specified
+        cattrs = cattrs or dlbf.cattrs if dlbf else None
+
+    elif not cattrs: # Can be "", then remove CAttrs
+        cattrs = None
+    else:
+        if dlbf and dlbf.cattrs: # Combine if dlbf has CAttrs
+            dlbf.cattrs.update(cattrs)
+            cattrs = dlbf.cattrs
+
+    # File opened here will be closed by the _push_wrapper()
+    opened = not isinstance(file, (IOBase, LimitedReader))
+    try:
+        if opened and file_size >= BUFFERED_READ_MIN_SIZE:
+            file = LimitedReader(file, 0, file_size, file_size)
+        elif opened:
+            file = open(file,'rb')
+
+        pf = await ctx.obj.dlb.prepare_file(
+            file = file,
+            file_path = file_path,
+            file_size = file_size,
+            cattrs = cattrs,
+            make_preview = (not no_thumb),
+            skip_fingerprint_check = True
+        )
+    except BaseException as e:
+        if opened and not isinstance(file, Path):
+            file.close()
+
+        if isinstance(e, tgbox.errors.LimitExceeded):
+            echo(f'[Y0b]{file_path}: {e} Skipping...[X]')
+            return
+
+        if isinstance(e, PermissionError):
+            echo(f'[R0b]{file_path} is not readable! Skipping...[X]')
+            return
+        raise
+
+    file_action[1]['pf'] = pf
+
+    if not progress_callback: # Otherwise it's from the TransferProgress
+        progressbar = ProgressBar(ctx.obj.enlighten_manager, file_path.name)
+        progress_callback = progressbar.update
+
+    if adaptive: # We need to count bytes for --auto-workers
+        progress_callback = adaptive.track(progress_callback)
+
+    if limiter: # Will wait on every chunk if speed is exceeded
+        progress_callback = limiter.track(progress_callback)
+
+    file_action[1]['progress_callback'] = progress_callback
+
+    return file_action
+
+async def _push_wrapper(
+        ctx, file, file_path, cattrs, force_update,
+        no_update, no_thumb, use_slow_upload, is_multipart,
+        on_uploaded=None, adaptive=None, limiter=None,
+        fingerprints=None, remote_boxes=None, progress=None,
+        progress_callback=None):
+    """
+    This function selects correct push action (either
+    updates file or uploads it) and wraps it.
+
+    on_uploaded callback (if specified) will be called with
+    Box file ID if file is uploaded or was uploaded before.
+
+    adaptive (AdaptiveLimits, if specified) will be told
+    about transferred bytes and errors.
+
+    limiter (RateLimiter, if specified) will limit the
+    upload speed. It's shared by all uploads.
+
+    fingerprints (FingerprintFilter, if specified) will be
+    checked before LocalBox request, and fingerprint of the
+    uploaded file will be added to it.
+
+    remote_boxes (RemoteBoxPool, if specified) will be used
+    to push new files by several accounts instead of one.
+
+    progress (TransferProgress, if specified) will be used
+    instead of the per-file progress bar.
+
+    progress_callback (if specified) is the progress.track()
+    callback of file that was tracked when it was queued.
+    """
+    if progress and not progress_callback:
+        progress_callback = progress.track(file_path.name)
+    try:
+        file_action = await _get_push_action(
+            ctx=ctx, file=file,
+            file_path=file_path,
+            cattrs=cattrs,
+            force_update=force_update,
+            no_update=no_update,
+            no_thumb=no_thumb,
+            is_multipart=is_multipart,
+            on_uploaded=on_uploaded,
+            adaptive=adaptive,
+            limiter=limiter,
+            fingerprints=fingerprints,
+            remote_boxes=remote_boxes,
+            progress_callback=progress_callback
+        )
+    except BaseException:
+        if progress:
+            progress.untrack(progress_callback)
+        raise
+
+    if file_action is None:
+        if progress: # File is skipped
+            progress.untrack(progress_callback)
+        return
+    try:
+        drbf = await file_action[0](**file_action[1],
+            use_slow_upload=use_slow_upload)
+    except BaseException as e:
+        if progress:
+            progress.untrack(progress_callback)
+
+        if adaptive and isinstance(e, Exception):
+            adaptive.report_error(e)
+        raise
+    finally:
+        # File was opened by the _get_push_action(), so we
+        # close it (and free its read buffer, if any) here
+        if not isinstance(file, (IOBase, LimitedReader)):
+            file_action[1]['pf'].file.close()
+
+    if fingerprints is not None:
+        fingerprints.add(file_action[1]['pf'].fingerprint)
+
+    if on_uploaded:
+        on_uploaded(drbf.id)
+
+    return drbf
+
+
+def _get_upload_limit(tc) -> int:
+    """
+    This function will return max size of file that
+    account of tc (TelegramClient) can upload.
+    """
+    if tgbox.sync(tc.get_me()).premium:
+        upload_limit = tgbox.defaults.UploadLimits.PREMIUM
+    else:
+        upload_limit = tgbox.defaults.UploadLimits.DEFAULT
+
+    # Subtract 32MB to leave space for possible Metadata
+    return upload_limit - 32_000_000
+
+def _connect_accounts(ctx, accounts: str, upload_limit: int) -> RemoteBoxPool:
+    """
+    This function will connect accounts (comma-separated
+    numbers from the account-list or "all") that can post
+    to the Box channel and return RemoteBoxPool of them
+    and of the Box owner. Other accounts are skipped.
+    """
+    remote_boxes = RemoteBoxPool(ctx.obj.drb, upload_limit)
+    account_list = ctx.obj.session['ACCOUNT_LIST']
+
+    if accounts == 'all':
+        numbers = range(1, len(account_list) + 1)
+    else:
+        numbers = [int(n) for n in accounts.split(',') if n.strip().isdigit()]
+
+    # Accounts in list can be the same as Box owner
+    connected = {tgbox.sync(ctx.obj.drb.tc.get_me()).id}
+
+    for number in numbers:
+        if number < 1 or number > len(account_list):
+            echo(f'[R0b]@ Invalid account number {number}. Skipping...[X]')
+            continue
+
+        tc = tgbox.api.TelegramClient(
+            session=account_list[number-1],
+            api_id=API_ID,
+            api_hash=API_HASH,
+            proxy=ctx.obj.proxy
+        )
+        tgbox.sync(tc.connect())
+
+        me = tgbox.sync(tc.get_me())
+        if not me: # Session was disconnected
+            echo(f'[R0b]@ Account #{number} is disconnected. Skipping...[X]')
+            tgbox.sync(tc.disconnect())
+            continue
+
+        if me.id in connected:
+            tgbox.sync(tc.disconnect())
+            continue
+        try:
+            drb = tgbox.sync(tgbox.api.get_remotebox(ctx.obj.dlb, tc=tc))
+        except (tgbox.errors.RemoteBoxInaccessible, tgbox.errors.SessionUnregistered):
+            echo(f'[Y0b]@ Account #{number} has no access to the Box. Skipping...[X]')
+            tgbox.sync(tc.disconnect())
+            continue
+
+        box_channel = drb.box_channel
+        admin_rights = box_channel.admin_rights
+
+        if not (box_channel.creator or admin_rights and admin_rights.post_messages):
+            echo(f'[Y0b]@ Account #{number} can\'t post to the Box. Skipping...[X]')
+            tgbox.sync(drb.done())
+            continue
+
+        remote_boxes.add(drb, _get_upload_limit(tc))
+        connected.add(me.id)
+
+        echo(f'[C0b]@ Account[X] [W0b]#{number}[X] [C0b]will upload to the Box[X]')
+
+    return remote_boxes
+
+def _hash_part(file_path: Path, offset: int, size: int):
+    """
+    This function will compute sha256 over one part of
+    Multipart file that starts at specified offset.
+    """
+    part_hash = sha256()
+
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+
+        while size > 0:
+            block = f.read(min(size, MULTIPART_HASH_BLOCK))
+            if not block:
+                break
+
+            part_hash.update(block)
+            size -= len(block)
+
+    return part_hash
+
+def _digest_part_hash(ctx, part_hash, part: int) -> bytes:
+    """
+    This function will make the final '__mp_hash'
+    value from the sha256 state of part bytes.
+    """
+    # Although CAttrs are already protected with FileKey,
+    # I want to add extra protection so checksums will
+    # differ on each unique Box, even if bytes are same
+    part_hash.update(tgbox.tools.int_to_bytes(part))
+    part_hash.update(ctx.obj.dlb.mainkey.key)
+    return part_hash.digest()
+
+def _track_queued(push_kwargs: dict, name: str, size: int) -> Optional[Callable]:
+    """
+    This function will return progress.track() callback
+    of file that is queued for upload, so it's counted
+    in the totals while it waits. Will return None if
+    there is no TransferProgress in push_kwargs.
+    """
+    if push_kwargs['progress']:
+        return push_kwargs['progress'].track(name, size)
+    return None
+
+async def _push_part(ctx, file, part, part_path, cattrs, push_kwargs) -> tuple:
+    """
+    This function will push one part of Multipart file and
+    close its reader. The '__mp_hash' is computed from the
+    same reads that feed encryption (file should be made
+    with hash_reads=True), so part is read only once.
+
+    Will return (drbf, part hash). Metadata is uploaded
+    before file data, so hash should be set by the
+    _link_multipart(). Hash is None if upload is failed
+    or if reader was seeked (e.g on retry).
+    """
+    try:
+        drbf = await _push_wrapper(
+            ctx = ctx,
+            file = file,
+            file_path = part_path,
+            cattrs = cattrs,
+            is_multipart = True,
+            **push_kwargs
+        )
+    finally:
+        file.close()
+
+    if not drbf or file.hash is None:
+        return drbf, None
+
+    return drbf, _digest_part_hash(ctx, file.hash, part)
+
+async def _link_multipart(ctx, part_ids: list, part_hashes: Optional[list]=None):
+    """
+    Every Multipart part has a '__mp_previous' CAttr with ID of
+    the previous part. If parts were uploaded at the same time,
+    we didn't know these IDs on upload, so here we will write
+    the chain as Metadata update of every unlinked part.
+
+    The same is for '__mp_total' of parts uploaded from
+    the stream, it will be set to the len(part_ids).
+
+    part_hashes (if specified) is a list of '__mp_hash' for
+    every part in part_ids (None if part is not changed).
+    """
+    previous_part_id = b'genesis'
+    multipart_total_b = tgbox.tools.int_to_bytes(len(part_ids))
+
+    part_hashes = part_hashes or [None] * len(part_ids)
+
+    for part_id, part_hash in zip(part_ids, part_hashes):
+        dlbf = await ctx.obj.dlb.get_file(part_id)
+        changes = {}
+
+        if part_hash and dlbf.cattrs.get('__mp_hash') != part_hash:
+            changes['__mp_hash'] = part_hash
+
+        if dlbf.cattrs.get('__mp_previous') != previous_part_id:
+            changes['__mp_previous'] = previous_part_id
+
+        if dlbf.cattrs.get('__mp_total') != multipart_total_b:
+            changes['__mp_total'] = multipart_total_b
+
+        if changes:
+            changes = tgbox.tools.PackedAttributes.pack(**changes)
+            await dlbf.update_metadata(
+                changes={'cattrs': changes}, drb=ctx.obj.drb)
+
+        previous_part_id = tgbox.tools.int_to_bytes(part_id)
+
+async def _remove_stale_parts(ctx, remote_path: Path, parts: int):
+    """
+    If file was uploaded before with more parts (e.g with
+    smaller part size or if it was bigger), its parts after
+    the new last one are left in the Box. Download expects
+    exactly '__mp_total' parts, so here we remove them.
+    """
+    stale_ids, p = [], parts
+
+    while True:
+        part_path = remote_path.parent / f'{remote_path.name}-{p}'
+        dlbf = await _get_file_by_path(ctx, part_path)
+
+        if not dlbf or not dlbf.cattrs or '__mp_part' not in dlbf.cattrs:
+            break
+
+        stale_ids.append(dlbf.id)
+        p += 1
+
+    if stale_ids:
+        echo(
+            f'[Y0b]| Removing {len(stale_ids)} part(s) of {remote_path.name} '
+             'left from the previous upload...[X]')
+        await ctx.obj.drb.delete_files(rbf_ids=stale_ids, lb=ctx.obj.dlb)
+
+async def _get_part_size(ctx, remote_path: Path, fingerprints=None) -> Optional[int]:
+    """
+    This function will return part size of the Multipart
+    file that is already uploaded to the remote_path, or
+    None if there is no such file (or it has one part).
+    """
+    part_path = remote_path.parent / f'{remote_path.name}-0'
+    dlbf = await _get_file_by_path(ctx, part_path, fingerprints)
+
+    if not dlbf or not dlbf.cattrs or '__mp_ver' not in dlbf.cattrs:
+        return None
+
+    mp_total = dlbf.cattrs.get('__mp_total')
+
+    if not mp_total or mp_total == MULTIPART_UNLINKED:
+        return None
+
+    if tgbox.tools.bytes_to_int(mp_total) < 2:
+        return None
+
+    return dlbf.size
+
+async def _upload_multipart(
+        ctx, current_path, remote_path, current_path_size,
+        parsed_cattrs, multipart_workers, part_cache, push_kwargs,
+        part_size, keep_part_size=True, cp_stat=None):
+    """
+    This function will upload file that is bigger than
+    Telegram limits as sequence of parts (Multipart).
+
+    If multipart_workers > 1, parts will be uploaded
+    at the same time and linked after upload.
+
+    If keep_part_size is True and file was already
+    uploaded (or partially) with other part size, we
+    will use it instead of the part_size, so parts
+    that are not changed will not be uploaded again.
+
+    Computed part checksums are saved to part_cache,
+    so we will not re-hash parts of unchanged file
+    when upload is resumed (or repeated).
+    """
+    loop = get_running_loop()
+
+    if keep_part_size:
+        part_size = await _get_part_size(
+            ctx, remote_path, push_kwargs['fingerprints']) or part_size
+
+    actual_file_size = current_path_size
+    parts = ceil(current_path_size / part_size)
+    multipart_total_b = tgbox.tools.int_to_bytes(parts)
+
+    multipart_offset = 0
+    previous_part_id = b'genesis'
+
+    # ID of every part in order. Parts that are uploaded in
+    # the pool will be set after all of them are finished
+    part_ids = [None] * parts
+    part_tasks = {}
+
+    # '__mp_hash' of uploaded parts, will be set by the
+    # _link_multipart(). None for parts that are skipped
+    new_hashes = [None] * parts
+
+    # Cached checksums are valid only while file stat is
+    # the same as it was on hashing. Any change to file
+    # will invalidate all of its cached checksums.
+    cp_stat = cp_stat or current_path.stat()
+    cp_stat = (cp_stat.st_size, cp_stat.st_mtime_ns, cp_stat.st_ino)
+
+    cache_key = str(current_path)
+    cached = part_cache.get(cache_key)
+
+    if not cached or cached['stat'] != cp_stat\
+        or cached.get('part_size') != part_size:
+            cached = {'stat': cp_stat, 'part_size': part_size, 'parts': {}}
+            part_cache[cache_key] = cached
+
+    part_hashes = cached['parts']
+
+    mp_pool = TransferPool(
+        max_workers = multipart_workers,
+        max_bytes = multipart_workers * part_size
+    )
+    try:
+        for p in range(parts):
+            # will be True if part is already uploaded
+            skip_upload = False
+
+            part_path = remote_path.parent / f'{remote_path.name}-{p}'
+
+            if actual_file_size >= part_size:
+                actual_size = part_size
+            else:
+                actual_size = actual_file_size
+
+            actual_file_size -= part_size
+
+            if not push_kwargs['force_update']:
+                dlbf_sf = tgbox.tools.SearchFilter(
+                    file_name=part_path.name,
+                    scope=str(part_path.parent)
+                )
+                dlbf = ctx.obj.dlb.search_file(dlbf_sf)
+                try:
+                    dlbf = await tgbox.tools.anext(dlbf)
+                except StopAsyncIteration:
+                    pass # Proceed with upload
+                else:
+                    if not dlbf.cattrs:
+                        echo(
+                            f'[R0b]x File "{part_path}" is already exists in '
+                            'your LocalBox, so upload of Multipart file is '
+                            'impossible! Please rename your file or verify '
+                            'that your LocalBox is not broken (if you see '
+                            'this error after broken multipart upload)![X]')
+                        await mp_pool.cancel()
+                        return
+
+                    if '__mp_ver' not in dlbf.cattrs:
+                        # If __mp_ver NOT in cattrs, this is the first
+                        # implemenation of Multipart files. In this
+                        # case, we will force update them to latest Ver
+                        pass
+
+                    # Part can be the same only if it has the same size
+                    # and its hash was attached, so only here we need
+                    # to read part from disk and compare checksums.
+                    # Parts of old (or broken) uploads without the
+                    # hash are always uploaded again
+                    elif dlbf.size == actual_size and dlbf.cattrs.get('__mp_hash'):
+                        part_hash = part_hashes.get(p)
+
+                        if not part_hash:
+                            # Hashing is a blocking disk read, so we will run
+                            # it in executor to not stall other transfers
+                            part_hash = await loop.run_in_executor(None,
+                                _hash_part, current_path, multipart_offset, actual_size)
+                            part_hash = _digest_part_hash(ctx, part_hash, p)
+
+                            part_hashes[p] = part_hash
+                            part_cache.commit()
+
+                        if dlbf.cattrs['__mp_hash'] == part_hash:
+                            echo(f'[Y0b]| Part {p} of file {remote_path.name} '
+                                'is already uploaded. Skipping...[X]')
+
+                            previous_part_id = tgbox.tools.int_to_bytes(dlbf.id)
+                            part_ids[p] = dlbf.id
+                            skip_upload = True
+
+            if not skip_upload:
+                cattrs = {} if not parsed_cattrs else deepcopy(parsed_cattrs)
+
+                if multipart_workers > 1 and p > 0:
+                    # We don't know ID of the previous part yet,
+                    # it will be set by the _link_multipart()
+                    cattrs['__mp_previous'] = MULTIPART_UNLINKED
+                else:
+                    cattrs['__mp_previous'] = previous_part_id
+
+                cattrs['__mp_part'] = tgbox.tools.int_to_bytes(p)
+                cattrs['__mp_total'] = multipart_total_b
+                cattrs['__mp_ver'] = MULTIPART_VERSION
+
+                # Hash is computed on upload and set by the
+                # _link_multipart(). Here it's empty to overwrite
+                # hash of the previous part version (if any), so
+                # part is taken as not uploaded if we're stopped
+                cattrs['__mp_hash'] = b''
+
+                file = LimitedReader(
+                    file_path=current_path,
+                    start_pos=multipart_offset,
+                    stop_pos=(multipart_offset + part_size),
+                    actual_size = actual_size,
+                    hash_reads = True
+                )
+                pp = _push_part(
+                    ctx = ctx,
+                    file = file,
+                    part = p,
+                    part_path = part_path,
+                    cattrs = cattrs,
+                    push_kwargs = {**push_kwargs, 'progress_callback':
+                        _track_queued(push_kwargs, part_path.name, actual_size)}
+                )
+                if multipart_workers > 1:
+                    part_tasks[p] = await mp_pool.submit(pp, actual_size)
+                else:
+                    drbf, new_hashes[p] = await pp
+
+                    if drbf:
+                        previous_part_id = tgbox.tools.int_to_bytes(drbf.id)
+                        part_ids[p] = drbf.id
+
+            multipart_offset += part_size
+
+        await mp_pool.join()
+    except Exception:
+        await mp_pool.cancel()
+        raise
+    finally:
+        part_cache.commit()
+
+    for p, task in part_tasks.items():
+        drbf, new_hashes[p] = task.result()
+        if drbf:
+            part_ids[p] = drbf.id
+
+    for p, part_hash in enumerate(new_hashes):
+        if part_hash: # Next run will not read part to compare
+            part_hashes[p] = part_hash
+    part_cache.commit()
+
+    if None in part_ids:
+        echo(
+            f'[R0b]x Some parts of {remote_path.name} were not '
+             'uploaded. Please try to upload this file again.[X]')
+        return
+
+    await _link_multipart(ctx, part_ids, new_hashes)
+    await _remove_stale_parts(ctx, remote_path, len(part_ids))
+
+def _read_stream_block(stream, part_size: int) -> tuple:
+    """
+    This function will read one block (part) of Multipart
+    file from the stream and return it with its sha256.
+    """
+    block = stream.read(part_size)
+    return block, sha256(block)
+
+async def _upload_stream(
+        ctx, stream, remote_path, parsed_cattrs,
+        multipart_workers, push_kwargs, part_size):
+    """
+    This function will upload data from the non-seekable
+    stream (e.g stdin) of unknown size. We read it by
+    blocks of part_size and upload every block
+    as a Multipart part as soon as it's filled, so nothing
+    is spooled to disk. Up to multipart_workers + 2 blocks
+    are kept in memory. If the whole stream fits into one
+    block, it will be uploaded as a regular file.
+
+    We don't know amount of parts until stream is ended,
+    so '__mp_total' (as well as '__mp_previous') will be
+    set by the _link_multipart() after upload.
+    """
+    loop = get_running_loop()
+
+    read_block = partial(loop.run_in_executor,
+        None, _read_stream_block, stream, part_size)
+
+    block, part_hash = await read_block()
+
+    if not block:
+        echo('[R0b]x Stream is empty. Nothing to upload.[X]')
+        return
+
+    # We read next block in advance to know if current is the last
+    next_block, next_part_hash = await read_block()
+
+    if not next_block:
+        await _push_wrapper(
+            ctx = ctx,
+            file = StreamPart(block, remote_path.name),
+            file_path = remote_path,
+            cattrs = parsed_cattrs,
+            is_multipart = False,
+            **push_kwargs
+        )
+        return
+
+    part_ids, part_tasks, p = [], {}, 0
+
+    mp_pool = TransferPool(
+        max_workers = multipart_workers,
+        max_bytes = multipart_workers * part_size
+    )
+    try:
+        while block:
+            part_path = remote_path.parent / f'{remote_path.name}-{p}'
+            part_hash = _digest_part_hash(ctx, part_hash, p)
+
+            dlbf = await _get_file_by_path(
+                ctx, part_path, push_kwargs['fingerprints'])
+
+            # Stream can be the same as on previous upload (e.g if
+            # it was interrupted), then we can skip same parts
+            if not push_kwargs['force_update'] and dlbf and dlbf.cattrs\
+                and dlbf.cattrs.get('__mp_hash') == part_hash:
+                    echo(f'[Y0b]| Part {p} of file {remote_path.name} '
+                        'is already uploaded. Skipping...[X]')
+                    part_ids.append(dlbf.id)
+            else:
+                cattrs = {} if not parsed_cattrs else deepcopy(parsed_cattrs)
+
+                cattrs['__mp_previous'] = MULTIPART_UNLINKED if p else b'genesis'
+                cattrs['__mp_part'] = tgbox.tools.int_to_bytes(p)
+                cattrs['__mp_total'] = MULTIPART_UNLINKED
+                cattrs['__mp_ver'] = MULTIPART_VERSION
+                cattrs['__mp_hash'] = part_hash
+
+                pw = _push_wrapper(
+                    ctx = ctx,
+                    file = StreamPart(block, part_path.name),
+                    file_path = part_path,
+                    cattrs = cattrs,
+                    is_multipart = True,
+                    progress_callback = _track_queued(
+                        push_kwargs, part_path.name, len(block)),
+                    **push_kwargs
+                )
+                part_tasks[p] = await mp_pool.submit(pw, len(block))
+                part_ids.append(None)
+
+            block, part_hash = next_block, next_part_hash
+            p += 1
+
+            if block:
+                next_block, next_part_hash = await read_block()
+
+        await mp_pool.join()
+    except Exception:
+        await mp_pool.cancel()
+        raise
+
+    for p, task in part_tasks.items():
+        if task.result():
+            part_ids[p] = task.result().id
+
+    if None in part_ids:
+        echo(
+            f'[R0b]x Some parts of {remote_path.name} were not '
+             'uploaded. Please try to upload this stream again.[X]')
+        return
+
+    await _link_multipart(ctx, part_ids)
+    await _remove_stale_parts(ctx, remote_path, len(part_ids))
+
+async def _push_bundle(
+        ctx, bundle, bundle_path, parsed_cattrs,
+        pool, push_kwargs):
+    """
+    This function will push bundle of small files as one
+    file. Its name is made from the index (which is sorted
+    by path and has SHA256 of members), so the same bundle
+    will not be uploaded twice.
+    """
+    data, index = bundle.pack()
+    name = f'.tgbox-bundle-{sha256(index).hexdigest()[:16]}'
+
+    cattrs = {} if not parsed_cattrs else deepcopy(parsed_cattrs)
+    cattrs['__bundle_index'] = index
+    cattrs['__bundle_ver'] = BUNDLE_VERSION
+
+    callbacks = bundle.callbacks
+
+    def on_uploaded(file_id: int):
+        for callback in callbacks:
+            callback(file_id)
+
+    echo(
+        f'[C0b]@ Bundling[X] [W0b]{len(bundle)}[X] small '
+        f'files into [W0b]{name}[X] ...')
+
+    pw = _push_wrapper(
+        ctx = ctx,
+        file = StreamPart(data, name),
+        file_path = bundle_path / name,
+        cattrs = cattrs,
+        is_multipart = False,
+        on_uploaded = on_uploaded,
+        progress_callback = _track_queued(push_kwargs, name, len(data)),
+        # We can't make thumbnail for the bundle
+        **{**push_kwargs, 'no_thumb': True}
+    )
+    await pool.submit(pw, len(data))
+
+async def _push_deduplicated(
+        ctx, dedupe, current_path, remote_path, cp_stat,
+        parsed_cattrs, on_uploaded, push_kwargs):
+    """
+    This function will check file for duplicates with the
+    Deduplicator and push either file or the reference.
+    """
+    entry, file_id = await dedupe.check(current_path, cp_stat)
+    try:
+        if file_id:
+            await _push_reference(
+                ctx, dedupe, entry, file_id, remote_path,
+                parsed_cattrs, on_uploaded, push_kwargs)
+            return
+
+        uploaded_ids = []
+
+        def _on_uploaded(file_id: int):
+            uploaded_ids.append(file_id)
+            if on_uploaded:
+                on_uploaded(file_id)
+
+        if entry.hash is None:
+            # Hash will be computed on upload, so we don't read file twice
+            file = LimitedReader(
+                file_path = current_path,
+                start_pos = 0,
+                stop_pos = cp_stat.st_size,
+                actual_size = cp_stat.st_size,
+                hash_reads = True
+            )
+        else:
+            file = current_path
+
+        try:
+            drbf = await _push_wrapper(
+                ctx = ctx,
+                file = file,
+                file_path = remote_path,
+                cattrs = parsed_cattrs,
+                is_multipart = False,
+                on_uploaded = _on_uploaded,
+                **push_kwargs
+            )
+        finally:
+            if isinstance(file, LimitedReader):
+                file.close()
+
+        if isinstance(file, LimitedReader):
+            if drbf and file.hash is not None:
+                entry.hash = file.hash.digest()
+                dedupe.index.set_local_hash(current_path, cp_stat, entry.hash)
+
+        if uploaded_ids:
+            if drbf and entry.hash is None:
+                await dedupe.hash(entry) # Reader was seeked, so read again
+
+            dedupe.uploaded(entry, uploaded_ids[0])
+    finally:
+        dedupe.uploaded(entry, None) # Will do nothing if uploaded
+
+async def _push_reference(
+        ctx, dedupe, entry, file_id, remote_path,
+        parsed_cattrs, on_uploaded, push_kwargs):
+    """
+    This function will report duplicate (entry) of the Box
+    file_id or will push reference to it, by --dedupe mode.
+    """
+    dedupe.uploaded(entry, file_id)
+
+    dlbf = await _get_file_by_path(
+        ctx, remote_path, push_kwargs['fingerprints'])
+    ref_id = tgbox.tools.int_to_bytes(file_id)
+
+    if dlbf and (dlbf.id == file_id or\
+        (dlbf.cattrs and dlbf.cattrs.get('__ref_id') == ref_id)):
+            echo(f'[Y0b]| File {entry.path} is already uploaded. Skipping...[X]')
+            if on_uploaded:
+                on_uploaded(dlbf.id)
+            return
+
+    dedupe.duplicates += 1
+    dedupe.saved_bytes += entry.stat.st_size
+
+    if dedupe.mode == 'report':
+        echo(
+            f'[Y0b]| File {entry.path} is a duplicate of '
+            f'the Box file ID{file_id}. Skipping...[X]')
+        return
+
+    echo(
+        f'[C0b]| File {entry.path} is a duplicate of the Box '
+        f'file ID{file_id}. Pushing reference...[X]')
+
+    cattrs = {} if not parsed_cattrs else deepcopy(parsed_cattrs)
+    cattrs['__ref_id'] = ref_id
+
+    await _push_wrapper(
+        ctx = ctx,
+        file = StreamPart(ref_id, remote_path.name),
+        file_path = remote_path,
+        cattrs = cattrs,
+        is_multipart = False,
+        on_uploaded = on_uploaded,
+        # Reference to other file can be of the same size
+        **{**push_kwargs, 'no_thumb': True, 'force_update':
+            push_kwargs['force_update'] or bool(dlbf and dlbf.cattrs\
+                and '__ref_id' in dlbf.cattrs)}
+    )
+
+async def _upload_targets(
+        ctx, target, filters, file_path, flat_path, parsed_cattrs,
+        calculate, upload_limit, force_multipart, multipart_workers,
+        part_cache, journal, pool, mp_pool, push_kwargs, ignore,
+        bundle_small, dedupe, previews, order, part_size,
+        keep_part_size, changed=None):
+    """
+    This coroutine walks over every target and feeds found
+    files to the TransferPool. Pool will start next upload
+    as soon as any of running ones is finished.
+
+    Multipart files are fed to the mp_pool. It should have
+    its own small amount of workers, as every Multipart
+    file uploads up to multipart_workers parts at once.
+    This way walk and upload of regular files is not
+    stopped while big file is uploaded.
+
+    filters should be a predicate from _compile_filters().
+
+    ignore is an IgnoreMatcher from the CLI, it will be
+    combined with the IGNORE_FILE of every target dir.
+
+    If bundle_small is specified, files smaller than it
+    will be packed into bundles, one bundle per target.
+
+    If dedupe (Deduplicator) is specified, regular (not
+    Multipart and not bundled) files will be checked for
+    duplicates before upload.
+
+    If previews (PreviewMaker) is specified, previews of
+    found files will be made before we wait for the pool.
+
+    order can be 'largest' or 'smallest' (first), see
+    the tools.transfer.order_by_size() for details.
+
+    part_size and keep_part_size are for Multipart files,
+    see the _upload_multipart() for details.
+
+    If changed (dict of target -> set of paths in it) is
+    specified, only these paths will be walked, not the
+    whole target. Targets without changes are skipped.
+    """
+    loop = get_running_loop()
+
+    for path in target:
+        if changed is not None and not changed.get(path):
+            continue
+
+        if not path.exists():
+            echo(f'[R0b]@ Target "{path}" doesn\'t exists! Skipping...[X]')
+            continue
+
+        if path.is_dir():
+            try:
+                next(path.iterdir())
+            except (FileNotFoundError, PermissionError, OSError):
+                echo(f'[R0b]@ Target "{path}" is not readable! Skipping...[X]')
+                continue
+
+        echo(f'[C0b]@ Working on[X] [W0b]{str(path.absolute())}[X] ...')
+
+        if path.is_dir():
+            # Patterns from the CLI will override ones from file
+            target_ignore = IgnoreMatcher.from_file(path / IGNORE_FILE) + ignore
+        else:
+            target_ignore = None
+
+        bundle = BundleWriter()
+
+        if file_path: # Bundles are placed in the target root
+            bundle_path = Path(file_path)
+        else:
+            bundle_path = path.resolve() if path.is_dir() else path.resolve().parent
+
+        # Will be used if --calculate specified
+        target_files, target_files_bs = 0, 0
+
+        # Directories are scanned in threads, and every entry has
+        # stat already made, so we don't touch FS for it again
+        if changed is None:
+            walker = walk_tree(path, ignore=target_ignore)
+        else:
+            walker = walk_paths(path, changed[path], ignore=target_ignore)
+
+        if order and not calculate:
+            walker = order_by_size(walker,
+                size = lambda entry: entry.stat.st_size if entry.stat else None,
+                largest_first = (order == 'largest')
+            )
+        async for current_path, is_dir, cp_stat, error in walker:
+            # Walking over big tree without any upload to wait
+            # for will block event loop, so we need to give
+            # running transfers a chance to progress
+            await sleep(0)
+
+            if is_dir:
+                if error:
+                    echo(f'[R0b]x Not Working on. {error}. Skipping...[X]')
+                else:
+                    echo(f'[C0b]@ Working on[X] [W0b]{str(current_path)}[X] ...')
+                continue
+
+            if error:
+                echo(f'[R0b]x {current_path} is not readable. Skipping...[X]')
+                continue
+
+            # --calculate ------------------------------------------------- #
+            if calculate:
+                cp_st_size = cp_stat.st_size
+
+                target_files += 1; target_files_bs += cp_st_size
+                target_files_bs_f = format_bytes(target_files_bs)
+
+                echo_text = (
+                    f'@ Total [W0b]targets found [X]([Y0b]{target_files}[X]) '
+                    f'size is [B0b]{target_files_bs_f}[X]({target_files_bs})   \r'
+                )
+                echo(echo_text, nl=False)
+                echo(' ' * 60 + '\r', nl=False)
+                continue
 
-def _check_filters(filters, current_path: Path):
-    """
-    This function will check filters against given File
-    (under current_path)
-    """
-    # Will use Regex Search if 're' is included in Filters, "In" otherwise.
-    in_func = re_search if filters.in_filters['re'] else lambda p,s: p in s
-    INCLUDE, EXCLUDE = 0, 1
+            if filters and not filters(current_path, cp_stat):
+                echo(
+                    f'[Y0b]x Target "{current_path}" is '
+                    'ignored by filters! Skipping...[X]'
+                )
+                continue
+            # ------------------------------------------------------------- #
 
-    for inex, filter in enumerate((filters.in_filters, filters.ex_filters)):
-        try:
-            if filter['min_time'] or filter['max_time']:
-                cp_st_mtime = current_path.stat().st_mtime # File Modification Time
+            if not file_path:
+                remote_path = current_path.resolve()
+            else:
+                if flat_path:
+                    remote_path = Path(file_path) / current_path.name
+                else:
+                    if path.is_dir():
+                        r = str(path.resolve())
+                    else:
+                        r = str(path.resolve().parent)
 
-            if filter['min_size'] or filter['max_size']:
-                cp_st_size = current_path.stat().st_size # File Size
+                    r = str(current_path).removeprefix(r)
+                    r = r.lstrip('/\\')
 
-            if filter['mime']:
-                file_mime = filetype_guess(current_path) # File MIME Type
-                file_mime = file_mime.mime if file_mime else ''
+                    remote_path = file_path / r
 
-            if filter['file_path']:
-                abs_path = str(current_path.absolute()) # File absolute Path
+            current_path_size = cp_stat.st_size
 
-        except (FileNotFoundError, PermissionError, OSError) as e:
-            echo(f'[R0b]x {e}. Skipping...[X]')
-            return
+            multipart_forced = ( # Force only if file is larger than 1 part
+                force_multipart and current_path_size > part_size
+            )
+            if multipart_forced or current_path_size > upload_limit:
+                if previews:
+                    previews.prefetch(current_path)
+
+                um = _upload_multipart(
+                    ctx = ctx,
+                    current_path = current_path,
+                    remote_path = remote_path,
+                    current_path_size = current_path_size,
+                    parsed_cattrs = parsed_cattrs,
+                    multipart_workers = multipart_workers,
+                    part_cache = part_cache,
+                    push_kwargs = push_kwargs,
+                    part_size = part_size,
+                    keep_part_size = keep_part_size,
+                    cp_stat = cp_stat
+                )
+                await mp_pool.submit(um, current_path_size)
+                continue
 
-        for filter_file_path in filter['file_path']:
-            if in_func(filter_file_path, abs_path): # pylint: disable=E0606
-                if inex == EXCLUDE:
-                    return
-                break
-        else:
-            if filter['file_path']:
-                if inex == INCLUDE:
-                    return
-
-        for file_name in filter['file_name']:
-            if in_func(file_name, current_path.name):
-                if inex == EXCLUDE:
-                    return
-                break
-        else:
-            if filter['file_name'] and inex == INCLUDE:
-                return
+            file_push_kwargs, on_uploaded = push_kwargs, None
 
-        for mime in filter['mime']:
-            if in_func(mime, file_mime):
-                if inex == EXCLUDE:
-                    return
-                break
-        else:
-            if filter['mime'] and inex == INCLUDE:
-                return
+            if journal:
+                journal_entry = UploadJournal.make_entry(remote_path, cp_stat)
+                journal_state = journal.check(current_path, journal_entry)
 
-        if filter['min_time']:
-            if cp_st_mtime < filter['min_time'][-1]: # pylint: disable=E0606
-                if inex == INCLUDE:
-                    return
+                if journal_state and not push_kwargs['force_update']:
+                    echo(
+                        f'[Y0b]| File {current_path} is already '
+                         'uploaded. Skipping...[X]')
+                    continue
 
-            elif cp_st_mtime >= filter['min_time'][-1]:
-                if inex == EXCLUDE:
-                    return
+                if journal_state is False and not push_kwargs['no_update']:
+                    # File was changed since the last upload. It can
+                    # have the same size, so we will force update
+                    file_push_kwargs = {**push_kwargs, 'force_update': True}
 
-        if filter['max_time']:
-            if cp_st_mtime > filter['max_time'][-1]:
-                if inex == INCLUDE:
-                    return
+                on_uploaded = partial(journal.record, current_path, journal_entry)
 
-            elif cp_st_mtime <= filter['max_time'][-1]:
-                if inex == EXCLUDE:
-                    return
+            if bundle_small and current_path_size < bundle_small:
+                try:
+                    data = await loop.run_in_executor(None, current_path.read_bytes)
+                except OSError:
+                    echo(f'[R0b]x {current_path} is not readable. Skipping...[X]')
+                    continue
 
-        if filter['min_size']:
-            if cp_st_size < filter['min_size'][-1]: # pylint: disable=E0606
-                if inex == INCLUDE:
-                    return
+                bundle.add(remote_path, data, cp_stat.st_mtime, on_uploaded)
 
-            elif cp_st_size >= filter['min_size'][-1]:
-                if inex == EXCLUDE:
-                    return
+                if bundle.full:
+                    await _push_bundle(
+                        ctx, bundle, bundle_path,
+                        parsed_cattrs, pool, push_kwargs)
+                    bundle = BundleWriter()
+                continue
 
-        if filter['max_size']:
-            if cp_st_size > filter['max_size'][-1]:
-                if inex == INCLUDE:
-                    return
+            if previews:
+                previews.prefetch(current_path)
+
+            if dedupe and current_path_size >= DEDUPE_MIN_SIZE:
+                pd = _push_deduplicated(
+                    ctx = ctx,
+                    dedupe = dedupe,
+                    current_path = current_path,
+                    remote_path = remote_path,
+                    cp_stat = cp_stat,
+                    parsed_cattrs = parsed_cattrs,
+                    on_uploaded = on_uploaded,
+                    push_kwargs = file_push_kwargs
+                )
+                await pool.submit(pd, current_path_size)
+                continue
 
-            elif cp_st_size <= filter['max_size'][-1]:
-                if inex == EXCLUDE:
-                    return
+            pw = _push_wrapper(
+                ctx = ctx,
+                file = current_path,
+                file_path = remote_path,
+                cattrs = parsed_cattrs,
+                is_multipart = False,
+                on_uploaded = on_uploaded,
+                progress_callback = _track_queued(
+                    push_kwargs, remote_path.name, current_path_size),
+                **file_push_kwargs
+            )
+            await pool.submit(pw, current_path_size)
 
-    return True # File matches against the filters
+        if calculate and target_files:
+            echo(' ' * 60 + '\r', nl=True)
+            echo(echo_text + '\n')
 
-async def _get_push_action(
-        ctx, file, file_path, cattrs, force_update,
-        no_update, no_thumb, is_multipart
-    ):
-    """Helper-function for the .push_file() coroutine"""
+        if len(bundle):
+            await _push_bundle(
+                ctx, bundle, bundle_path,
+                parsed_cattrs, pool, push_kwargs)
 
-    fingerprint = tgbox.tools.make_file_fingerprint(
-        mainkey = ctx.obj.dlb.mainkey,
-        file_path = str(file_path)
-    )
-    dlbf = await ctx.obj.dlb.get_file(fingerprint=fingerprint)
+    await pool.join() # Wait for all files left
+    await mp_pool.join()
 
-    if isinstance(file, LimitedReader):
-        file_size = file.size
-    else:
-        file_size = getsize(file)
+async def _watch_targets(target, rescan_interval, upload_kwargs):
+    """
+    This coroutine will upload target and then watch it for
+    created and modified files (see tools.watch.TreeWatcher),
+    so only they will be uploaded, by the _upload_targets().
+
+    Every rescan_interval seconds (and if some events were
+    lost) we walk the whole target again to catch missed
+    changes. This is cheap, as files that were not changed
+    are skipped by the upload journal, without requests.
+    """
+    watcher = TreeWatcher()
 
-    # Standard file upload if dlbf is not exists (from scratch)
-    if not dlbf and not force_update:
-        file_action = (ctx.obj.drb.push_file, {})
+    if not watcher.start():
+        echo(
+            '[Y0b]@ File system events are not supported on '
+            'this OS, targets will be only rescanned[X]')
+    try:
+        if watcher.watching:
+            for path in target:
+                if path.is_dir():
+                    await watcher.watch(path, IgnoreMatcher.from_file(
+                        path / IGNORE_FILE) + upload_kwargs['ignore'])
 
-    # File re-uploading (or updating) if file size differ
-    elif is_multipart or (force_update or not no_update and\
-        dlbf and dlbf.size != file_size):
-            # If 'is_multipart' and file was sent here, it means that
-            # checksums differ, and we should omit checking by file
-            # size, as it will be same.
+                elif path.exists(): # Only the file itself, not sub-dirs
+                    await watcher.watch(path.parent, IgnoreMatcher(['*/']))
 
-            if not dlbf: # Wasn't uploaded before
-                file_action = (ctx.obj.drb.push_file, {})
-            else:
-                drbf = await ctx.obj.drb.get_file(dlbf.id)
-                file_action = (ctx.obj.drb.update_file, {'rbf': drbf})
-    else:
-        # Ignore upload if file exists and wasn't changed
-        name = getattr(file, 'name', file)
-        echo(f'[Y0b]| File {name} is already uploaded. Skipping...[X]')
-        return
+            if watcher.limited:
+                echo(
+                    '[Y0b]@ Limit of inotify watches is reached, some dirs '
+                    'will be only rescanned (see fs.inotify.max_user_watches)[X]')
 
-    if cattrs is None: # CAttrs not specified
-        cattrs = cattrs or dlbf.cattrs if dlbf else None
+        # Watcher is started before upload, so files that
+        # are changed while we upload will be not missed
+        await _upload_targets(target=target, **upload_kwargs)
 
-    elif not cattrs: # Can be "", then remove CAttrs
-        cattrs = None
-    else:
-        if dlbf and dlbf.cattrs: # Combine if dlbf has CAttrs
-            dlbf.cattrs.update(cattrs)
-            cattrs = dlbf.cattrs
+        next_rescan = monotonic() + rescan_interval
+        echo('[C0b]@ Watching for changes. Press Ctrl+C to stop...[X]')
 
-    if not isinstance(file, (IOBase, LimitedReader)):
-        file = open(file,'rb')
-    try:
-        pf = await ctx.obj.dlb.prepare_file(
-            file = file,
-            file_path = file_path,
-            file_size = file_size,
-            cattrs = cattrs,
-            make_preview = (not no_thumb),
-            skip_fingerprint_check = True
-        )
-    except tgbox.errors.LimitExceeded as e:
-        echo(f'[Y0b]{file}: {e} Skipping...[X]')
-        return
+        while True:
+            timeout = max(next_rescan - monotonic(), 0)
 
-    except PermissionError:
-        echo(f'[R0b]{file} is not readable! Skipping...[X]')
-        return
+            if watcher.watching:
+                changes = await watcher.changes(timeout)
+            else:
+                await sleep(timeout)
+                changes = set()
 
-    progressbar = ProgressBar(ctx.obj.enlighten_manager, file_path.name)
+            if changes is None or monotonic() >= next_rescan:
+                echo('[C0b]@ Rescanning targets...[X]')
 
-    file_action[1]['pf'] = pf
-    file_action[1]['progress_callback'] = progressbar.update
+                await _upload_targets(target=target, **upload_kwargs)
+                next_rescan = monotonic() + rescan_interval
+                continue
 
-    return file_action
+            changed = {}
+            for path in target:
+                if path.is_dir():
+                    prefix = path_join(str(path), '')
+                    changed[path] = {p for p in changes if str(p).startswith(prefix)}
 
-async def _push_wrapper(
-        ctx, file, file_path, cattrs, force_update,
-        no_update, no_thumb, use_slow_upload, is_multipart):
-    """
-    This function selects correct push action (either
-    updates file or uploads it) and wraps it.
-    """
-    file_action = await _get_push_action(
-        ctx=ctx, file=file,
-        file_path=file_path,
-        cattrs=cattrs,
-        force_update=force_update,
-        no_update=no_update,
-        no_thumb=no_thumb,
-        is_multipart=is_multipart
-    )
-    if file_action is None:
-        return
+                elif path in changes:
+                    changed[path] = {path}
 
-    return await file_action[0](**file_action[1],
-        use_slow_upload=use_slow_upload)
+            if any(changed.values()):
+                await _upload_targets(
+                    target=target, changed=changed, **upload_kwargs)
+    finally:
+        watcher.close()
 
 @cli_group.command()
 @click.argument(
@@ -353,12 +1734,107 @@ async def _push_wrapper(
         'If specified, will force multipart upload even if we can '
         'use regular upload (file is smaller than Telegram limits)')
 )
+@click.option(
+    '--multipart-workers', default=1, type=click.IntRange(1,10),
+    help = (
+        'Max amount of Multipart file parts we will upload at the '
+        'same time. Parts will be linked after upload, default=1')
+)
+@click.option(
+    '--part-size', callback=bytesize,
+    help = (
+        'Size of Multipart file parts, e.g "500MB". Max that your account '
+        'can upload by default (256MB for stdin and --force-multipart). '
+        'Already uploaded files keep their part size if not specified')
+)
+@click.option(
+    '--ignore', '-I', multiple=True,
+    help = (
+        'Gitignore-style pattern of paths to skip. Matched dirs '
+        'will not be walked into. Can be specified multiple times')
+)
+@click.option(
+    '--auto-workers', is_flag=True,
+    help = (
+        'If specified, will tune --max-workers and --max-bytes at '
+        'runtime by measured throughput, FloodWaits and errors. '
+        'Specified values are used as a start')
+)
+@click.option(
+    '--max-upload-speed', default=TGBOX_CLI_UPLOAD_SPEED,
+    callback=speed_limiter,
+    help = (
+        'Max upload speed per second of all files in total, e.g "10MB". '
+        'TGBOX_CLI_UPLOAD_SPEED env variable by default, unlimited if unset')
+)
+@click.option(
+    '--bundle-small', callback=bytesize,
+    help = (
+        'Pack files smaller than this size (e.g "64KB") into bundles '
+        'of up to 64MB, one Box file per bundle. See the --bundled '
+        'flag of file-search and file-download')
+)
+@click.option(
+    '--dedupe', 'dedupe_mode', type=click.Choice(['link', 'report']),
+    help = (
+        'Find files with the same content as already uploaded ones '
+        '(hardlinks and copies) before upload. "link" will push them '
+        'as small references to the original Box file, "report" will '
+        'only show and skip them. Multipart files are not checked')
+)
+@click.option(
+    '--order', type=click.Choice(['largest', 'smallest']),
+    help = (
+        'Upload "largest" files first (less time with idle workers at the '
+        'end) or "smallest" first (fast feedback). Files are ordered '
+        'within a window of 1000, so the tree is not loaded in memory')
+)
+@click.option(
+    '--accounts', '-A',
+    help = (
+        'Comma-separated numbers of connected accounts (see account-list) '
+        'or "all". New files will be uploaded by them and the Box account '
+        'at the same time, with --max-workers and --max-bytes per account. '
+        'Accounts that can\'t post to the Box channel are skipped')
+)
+@click.option(
+    '--connections', type=click.IntRange(1,100),
+    help = (
+        'Max amount of connections per Telegram data center that will '
+        'be kept open and shared by all files. Every file gets up to 20 '
+        'of them. By default, every file opens and closes its own')
+)
+@click.option(
+    '--watch', is_flag=True,
+    help = (
+        'If specified, will not exit after upload, but will watch '
+        'TARGET for created and modified files and upload them. Uses '
+        'inotify (Linux), on other OS only rescans TARGET by interval')
+)
+@click.option(
+    '--watch-rescan', default=3600, type=click.IntRange(60),
+    help = (
+        'Interval (in seconds) of the full TARGET rescan in --watch '
+        'mode, to catch changes that were missed by events, default=3600')
+)
+@click.option(
+    '--progress', 'progress_mode', default='aggregate',
+    type=click.Choice(['aggregate', 'files', 'plain']),
+    help = (
+        'How to show progress: "aggregate" shows total of the whole '
+        'upload and top active files, "files" shows bar per file and '
+        '"plain" prints summary line sometimes (for logs). "aggregate" '
+        'is printed as "plain" if output is not a terminal')
+)
 @ctx_require(dlb=True, drb=True)
 def file_upload(
         ctx, target, file_path, flat_path, cattrs,
         no_update, force_update, use_slow_upload,
         no_thumb, calculate, max_workers, max_bytes,
-        force_multipart):
+        force_multipart, multipart_workers, part_size, ignore,
+        auto_workers, max_upload_speed, bundle_small, dedupe_mode,
+        order, accounts, connections, watch, watch_rescan,
+        progress_mode):
     """
     Upload TARGET by specified filters to the Box
 
@@ -367,8 +1843,28 @@ def file_upload(
     If TARGET is a Directory, -- this command
     will upload to Box all files from dir.
     \b
+    If TARGET is "-", will upload data from the stdin
+    to the --file-path (full path with file name). The
+    stream is split into Multipart parts on the fly.
+    \b
     If file was already uploaded but changed (in size)
     and --no-update is NOT specified, -- will re-upload.
+    Files uploaded from this machine are also checked
+    by modification time (see the upload journal).
+    \b
+    With --watch, command will keep running after upload
+    and push only new and changed files of the TARGET,
+    as soon as they are closed after write.
+    \b
+    With --accounts, new files are spread over several
+    connected accounts that are admins of the Box channel
+    (e.g to bypass per-account limits), but updated files
+    are always uploaded by the Box account.
+    \b
+    With --dedupe=link, duplicates are uploaded as references
+    to the Box file ID of the original and downloaded as it.
+    If you remove or update the original, its references
+    will be broken, so use it for immutable files.
     \b
     Available filters:\b
         file_path str: File path
@@ -391,6 +1887,12 @@ def file_upload(
     \b
     Please note that Filters should be placed after TARGET!
     \b
+    Filters are checked against every found file. To
+    skip whole directories (e.g "node_modules" or ".git")
+    without walking into them, place gitignore-style
+    patterns into the .tgboxignore file in the TARGET
+    directory or specify them with --ignore.
+    \b
     You can also use special flags to specify
     that filters is for include or exclude search:
     \b
@@ -404,6 +1906,9 @@ def file_upload(
         # Exclude flag (ignore .DOC, upload every single file from Documents)
         tgbox-cli file-upload /home/non/Documents +e file_name='.doc'
         \b
+        # Upload from the stdin (stream of unknown size)
+        pg_dump db | zstd | tgbox-cli file-upload - -f /backups/db.sql.zst
+        \b
         You can use both, the ++include and ++exclude (+i, +e)
         in one command, but make sure to place them after TARGET!
     """
@@ -440,12 +1945,28 @@ def file_upload(
     else:
         filters = None
 
+    from_stdin = '-' in (str(p) for p in target)
+
+    if from_stdin:
+        if len(target) > 1 or filters or calculate or watch:
+            echo(
+                '[R0b]Stdin ("-") can\'t be used with other '
+                'targets, filters, --calculate or --watch[X]')
+            return
+
+        if not file_path:
+            echo(
+                '[R0b]You should specify --file-path (full path '
+                'of file in Box) to upload from the stdin[X]')
+            return
+
+    if watch and calculate:
+        echo('[R0b]--watch can\'t be used with --calculate[X]')
+        return
+
     # Remove all duplicates present in Target (if any)
     target = tuple(set(Path(p).resolve() for p in target))
 
-    current_workers = max_workers
-    current_bytes = max_bytes
-
     if cattrs is not None and not cattrs:
         parsed_cattrs = {}
 
@@ -454,244 +1975,193 @@ def file_upload(
     else:
         parsed_cattrs = None
 
+    upload_limit, part_cache, journal, mime_cache = None, None, None, None
+    dedupe, previews, fingerprints, remote_boxes = None, None, None, None
+    content_index = None
+    senders, progress = None, None
+
    # We can omit request to drb if --calculate, as we don't use
     if not calculate: # upload_limit there at all
-        has_premium = tgbox.sync(ctx.obj.drb.tc.get_me()).premium
-        if has_premium:
-            upload_limit = tgbox.defaults.UploadLimits.PREMIUM
-        else:
-            upload_limit = tgbox.defaults.UploadLimits.DEFAULT
+        upload_limit = _get_upload_limit(ctx.obj.drb.tc)
 
-        upload_limit -= 32_000_000 # Subtract 32MB to leave space
-                                      # for possible Metadata
+        if part_size and part_size > upload_limit:
+            echo(
+                f'[R0b]--part-size can\'t be bigger than '
+                f'{upload_limit} bytes on your account[X]')
+            return
 
-    for path in target:
-        if not path.exists():
-            echo(f'[R0b]@ Target "{path}" doesn\'t exists! Skipping...[X]')
-            continue
+    if part_size: # Part size is specified by user
+        mp_part_size, keep_part_size = part_size, False
 
-        if path.is_dir():
-            try:
-                next(path.iterdir())
-            except (FileNotFoundError, PermissionError, OSError):
-                echo(f'[R0b]@ Target "{path}" is not readable! Skipping...[X]')
-                continue
+    elif force_multipart or from_stdin:
+        mp_part_size, keep_part_size = MULTIPART_PART_SIZE, True
+    else:
+        mp_part_size, keep_part_size = upload_limit, True
 
-        if path.is_dir():
-            iter_over = path.rglob('*')
-        else:
-            iter_over = (path,)
+    if not calculate and not from_stdin:
+        # Checksums of Multipart file parts from previous runs
+        part_cache = BoxCache(ctx.obj.dlb, 'mp_hashes')
 
-        echo(f'[C0b]@ Working on[X] [W0b]{str(path.absolute())}[X] ...')
+        # Record of files uploaded on previous runs. With it
+        # we can skip unchanged files without LocalBox lookups
+        journal = UploadJournal(ctx.obj.dlb)
+        tgbox.sync(journal.load())
 
-        # Will be used if --calculate specified
-        target_files, target_files_bs = 0, 0
+        # Fingerprints of all LocalBox files, so we will not
+        # make LocalBox request per file that is surely new
+        fingerprints = FingerprintFilter(ctx.obj.dlb)
+        tgbox.sync(fingerprints.load())
 
-        to_upload = []
-        for current_path in iter_over:
-            try:
-                if current_path.is_dir():
-                    echo(f'[C0b]@ Working on[X] [W0b]{str(current_path)}[X] ...')
-                    continue
-                else:
-                    open(current_path,'rb') # check if we can read file
-            except (FileNotFoundError, PermissionError, OSError) as e:
-                if current_path.is_dir():
-                    echo(f'[R0b]x Not Working on. {e}. Skipping...[X]')
-                else:
-                    echo(f'[R0b]x {current_path} is not readable. Skipping...[X]')
-                continue
+        if filters and (filters.in_filters['mime'] or filters.ex_filters['mime']):
+            # Guessed MIME types of files. We need to read
+            # file to guess it, so cache them between runs
+            mime_cache = BoxCache(ctx.obj.dlb, 'mime_types')
 
-            # --calculate ------------------------------------------------- #
-            if calculate:
-                if not current_path.exists():
-                    echo(
-                       f'[R0b]x Target "{current_path}" doesn\'t '
-                        'exists! Skipping...[X]')
-                    continue
+        if dedupe_mode:
+            # Checksums of uploaded and local files, so we can
+            # find duplicates without reading unchanged files
+            content_index = ContentIndex(ctx.obj.dlb)
+            tgbox.sync(content_index.load())
 
-                cp_st_size = current_path.stat().st_size
+            dedupe = Deduplicator(content_index, dedupe_mode)
 
-                target_files += 1; target_files_bs += cp_st_size
-                target_files_bs_f = format_bytes(target_files_bs)
+        if not no_thumb:
+            # Previews are made on the thread pool ahead of
+            # upload and cached on disk by the file content
+            previews = PreviewMaker(ctx.obj.dlb, index=content_index)
+            previews.install()
 
-                echo_text = (
-                    f'@ Total [W0b]targets found [X]([Y0b]{target_files}[X]) '
-                    f'size is [B0b]{target_files_bs_f}[X]({target_files_bs})   \r'
-                )
-                echo(echo_text, nl=False)
-                echo(' ' * 60 + '\r', nl=False)
-                continue
+    if filters: # Will be used as predicate
+        filters = _compile_filters(filters, mime_cache)
 
-            if filters and not _check_filters(filters, current_path):
-                echo(
-                    f'[Y0b]x Target "{current_path}" is '
-                    'ignored by filters! Skipping...[X]'
-                )
-                continue
-            # ------------------------------------------------------------- #
+    if connections and not calculate:
+        # Connections will be reused between files
+        senders = SenderPool(connections)
 
-            if not file_path:
-                remote_path = current_path.resolve()
-            else:
-                if flat_path:
-                    remote_path = Path(file_path) / current_path.name
-                else:
-                    if path.is_dir():
-                        r = str(path.resolve())
-                    else:
-                        r = str(path.resolve().parent)
+        if not senders.install():
+            echo(
+                '[Y0b]Installed tgbox is not supported by --connections, '
+                'connections will not be reused.[X]')
 
-                    r = str(current_path).removeprefix(r)
-                    r = r.lstrip('/\\')
+    # Ranges of --max-workers and --max-bytes on --auto-workers
+    workers_range, bytes_range = (1, 50), (1000000, 1000000000)
 
-                    remote_path = file_path / r
+    if accounts and not calculate:
+        remote_boxes = _connect_accounts(ctx, accounts, upload_limit)
 
-            current_path_size = getsize(current_path)
-            current_bytes -= current_path_size
-            current_workers -= 1
+        # Every account gets its own share of workers and bytes
+        max_workers *= len(remote_boxes)
+        max_bytes *= len(remote_boxes)
 
-            if not all((current_workers > 0, current_bytes > 0)):
-                try:
-                    tgbox.sync(gather(*to_upload))
-                    to_upload.clear()
-                except tgbox.errors.NotEnoughRights as e:
-                    echo(f'\n[R0b]{e}[X]')
-                    return
+        workers_range = (1, workers_range[1] * len(remote_boxes))
+        bytes_range = (1000000, bytes_range[1] * len(remote_boxes))
 
-                current_workers = max_workers - 1
-                current_bytes = max_bytes - current_path_size
+    if progress_mode != 'files' and not calculate:
+        progress = TransferProgress(ctx.obj.enlighten_manager,
+            'Upload', plain=(progress_mode == 'plain'))
 
-            multipart_forced = ( # Force only if file is larger than 1 block
-                force_multipart and current_path_size > MULTIPART_BLOCK_SIZE
+    if auto_workers and not calculate:
+        adaptive = AdaptiveLimits('upload', max_workers, max_bytes,
+            workers_range=workers_range, bytes_range=bytes_range)
+    else:
+        adaptive = None
+
+    push_kwargs = {
+        'force_update': force_update,
+        'no_update': no_update,
+        'no_thumb': no_thumb,
+        'use_slow_upload': use_slow_upload,
+        'adaptive': adaptive,
+        'limiter': max_upload_speed,
+        'fingerprints': fingerprints,
+        'remote_boxes': remote_boxes,
+        'progress': progress
+    }
+    pool = TransferPool(max_workers, max_bytes)
+
+    # Multipart files are uploaded in the background, one
+    # at a time. Their parts are limited by multipart_workers
+    mp_pool = TransferPool(max_workers=1, max_bytes=0)
+
+    if adaptive:
+        adaptive.attach(pool)
+
+    if from_stdin:
+        upload_coroutine = _upload_stream(
+            ctx = ctx,
+            stream = click.get_binary_stream('stdin'),
+            remote_path = file_path,
+            parsed_cattrs = parsed_cattrs,
+            multipart_workers = multipart_workers,
+            # We can't make thumbnail from the stream
+            push_kwargs = {**push_kwargs, 'no_thumb': True},
+            part_size = mp_part_size
+        )
+    else:
+        upload_kwargs = dict(
+            ctx = ctx,
+            filters = filters,
+            file_path = file_path,
+            flat_path = flat_path,
+            parsed_cattrs = parsed_cattrs,
+            calculate = calculate,
+            upload_limit = upload_limit,
+            force_multipart = force_multipart,
+            multipart_workers = multipart_workers,
+            part_cache = part_cache,
+            journal = journal,
+            pool = pool,
+            mp_pool = mp_pool,
+            push_kwargs = push_kwargs,
+            ignore = IgnoreMatcher(ignore),
+            bundle_small = bundle_small,
+            dedupe = dedupe,
+            previews = previews,
+            order = order,
+            part_size = mp_part_size,
+            keep_part_size = keep_part_size
+        )
+        if watch:
+            upload_coroutine = _watch_targets(
+                target = target,
+                rescan_interval = watch_rescan,
+                upload_kwargs = upload_kwargs
             )
-            if multipart_forced or current_path_size > upload_limit:
-                # --- Multi upload --------------------------------- #
-                MULTIPART_VERSION = tgbox.tools.int_to_bytes(1)
-
-                actual_file_size = current_path_size
-                parts = ceil(current_path_size / MULTIPART_BLOCK_SIZE)
-                multipart_total_b = tgbox.tools.int_to_bytes(parts)
-
-                multipart_offset = 0
-                previous_part_id = b'genesis'
-
-                for p in range(parts):
-                    # will be True if part is already uploaded
-                    skip_upload = False
-                    p_bytes = tgbox.tools.int_to_bytes(p)
-
-                    part_path = remote_path.parent / f'{remote_path.name}-{p}'
-                    part_hash = sha256()
-
-                    with open(current_path, 'rb') as f:
-                        f.seek(current_path_size - actual_file_size)
-
-                        for _ in range(MULTIPART_BLOCK_SIZE // 64_000_000):
-                            part_hash.update(f.read(64_000_000))
-
-                    # Although CAttrs are already protected with FileKey,
-                    # I want to add extra protection so checksums will
-                    # differ on each unique Box, even if bytes are same
-                    part_hash.update(p_bytes)
-                    part_hash.update(ctx.obj.dlb.mainkey.key)
-                    part_hash = part_hash.digest()
-
-                    if not force_update:
-                        dlbf_sf = tgbox.tools.SearchFilter(
-                            file_name=part_path.name,
-                            scope=str(part_path.parent)
-                        )
-                        dlbf = ctx.obj.dlb.search_file(dlbf_sf)
-                        try:
-                            dlbf = next(sync_async_gen(dlbf))
-                        except StopIteration:
-                            pass # Proceed with upload
-                        else:
-                            if not dlbf.cattrs:
-                                echo(
-                                    f'[R0b]x File "{part_path}" is already exists in '
-                                    'your LocalBox, so upload of Multipart file is '
-                                    'impossible! Please rename your file or verify '
-                                    'that your LocalBox is not broken (if you see '
-                                    'this error after broken multipart upload)![X]')
-                                break # will jump to continue
-
-                            if '__mp_ver' not in dlbf.cattrs:
-                                # If __mp_ver NOT in cattrs, this is the first
-                                # implemenation of Multipart files. In this
-                                # case, we will force update them to latest Ver
-                                pass
-
-                            elif dlbf.cattrs and dlbf.cattrs['__mp_hash'] == part_hash:
-                                echo(f'[Y0b]| Part {p} of file {remote_path.name} '
-                                    'is already uploaded. Skipping...[X]')
-
-                                previous_part_id = tgbox.tools.int_to_bytes(dlbf.id)
-                                skip_upload = True
-
-                    if actual_file_size >= MULTIPART_BLOCK_SIZE:
-                        actual_size = MULTIPART_BLOCK_SIZE
-                    else:
-                        actual_size = actual_file_size
-
-                    actual_file_size -= MULTIPART_BLOCK_SIZE
-
-                    if not skip_upload:
-                        cattrs = {} if not parsed_cattrs else deepcopy(parsed_cattrs)
-
-                        cattrs['__mp_previous'] = previous_part_id
-                        cattrs['__mp_part'] = tgbox.tools.int_to_bytes(p)
-                        cattrs['__mp_total'] = multipart_total_b
-                        cattrs['__mp_ver'] = MULTIPART_VERSION
-                        cattrs['__mp_hash'] = part_hash
-
-                        file = LimitedReader(
-                            file_path=current_path,
-                            start_pos=multipart_offset,
-                            stop_pos=(multipart_offset + MULTIPART_BLOCK_SIZE),
-                            actual_size = actual_size
-                        )
-                        pw = _push_wrapper(
-                            ctx = ctx,
-                            file = file,
-                            file_path = part_path,
-                            cattrs = cattrs,
-                            force_update = force_update,
-                            no_update = no_update,
-                            no_thumb = no_thumb,
-                            use_slow_upload = use_slow_upload,
-                            is_multipart = True
-                        )
-                        drbf = tgbox.sync(pw)
-                        previous_part_id = tgbox.tools.int_to_bytes(drbf.id)
-                        file.close()
+        else:
+            upload_coroutine = _upload_targets(target=target, **upload_kwargs)
+    try:
+        tgbox.sync(upload_coroutine)
+    except tgbox.errors.NotEnoughRights as e:
+        echo(f'\n[R0b]{e}[X]')
+    finally:
+        tgbox.sync(pool.cancel()) # Drop transfers left (if any)
+        tgbox.sync(mp_pool.cancel())
 
-                    multipart_offset += MULTIPART_BLOCK_SIZE
+        if previews:
+            tgbox.sync(previews.close())
 
-                continue
-                # -------------------------------------------------- #
+        if remote_boxes:
+            tgbox.sync(remote_boxes.close())
 
-            pw = _push_wrapper(
-                ctx = ctx,
-                file = current_path,
-                file_path = remote_path,
-                cattrs = parsed_cattrs,
-                force_update = force_update,
-                no_update = no_update,
-                no_thumb = no_thumb,
-                use_slow_upload = use_slow_upload,
-                is_multipart = False
-            )
-            to_upload.append(pw)
+        if senders:
+            tgbox.sync(senders.close())
 
-        if to_upload: # If any files left
-            try:
-                tgbox.sync(gather(*to_upload))
-                to_upload.clear()
-            except tgbox.errors.NotEnoughRights as e:
-                echo(f'\n[R0b]{e}[X]')
+        if progress:
+            progress.close()
 
-        if calculate and target_files:
-            echo(' ' * 60 + '\r', nl=True)
-            echo(echo_text + '\n')
+        if journal:
+            journal.commit()
+
+        if mime_cache is not None:
+            mime_cache.commit()
+
+        if adaptive:
+            adaptive.close()
+
+        if dedupe:
+            dedupe.index.commit()
+
+            if dedupe.duplicates:
+                echo(
+                    f'[C0b]@ Found[X] [W0b]{dedupe.duplicates}[X] duplicates, '
+                    f'[W0b]{format_bytes(dedupe.saved_bytes)}[X] not uploaded')
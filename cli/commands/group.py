@@ -96,6 +96,8 @@ def cli_group(ctx):
     else:
         proxy = None
 
+    ctx.obj.proxy = proxy
+
     # ========================================================= #
     # = Setting CLI Session =================================== #
 
@@ -8,6 +8,8 @@ from inspect import iscoroutine, isfunction
 from .errors import CheckCTXFailed
 from ..tools.terminal import echo
 from ..tools.other import sync_async_gen
+from ..tools.convert import formatted_bytes_to_int
+from ..tools.transfer import RateLimiter
 from ..config import tgbox
 
 
@@ -24,6 +26,7 @@ class Objects:
 
         self._account = None
         self.session = None
+        self.proxy = None
 
         self._enlighten_manager = None
 
@@ -107,6 +110,34 @@ def ctx_require(**check_ctx_kwargs):
 
     return check_ctx_decorator
 
+def bytesize(ctx, param, value):
+    """
+    This is a click callback for bytesize options. It will
+    convert string bytesize (e.g "10MB") to int, or will
+    return None if not specified.
+    """
+    if not value:
+        return None
+    try:
+        size = formatted_bytes_to_int(value)
+    except ValueError:
+        size = 0
+
+    if size <= 0:
+        raise click.BadParameter(
+            'Should be positive bytesize, e.g "10MB", "700KB" or "500000"')
+
+    return size
+
+def speed_limiter(ctx, param, value):
+    """
+    This is a click callback for speed limit options. It
+    will make RateLimiter from string speed (bytes per
+    second), e.g "10MB", or return None if not specified.
+    """
+    speed = bytesize(ctx, param, value)
+    return RateLimiter(speed) if speed else None
+
 @ctx_require(account=True)
 def select_remotebox(ctx, number: int, prefix: str):
     """
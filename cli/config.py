@@ -10,6 +10,11 @@ TGBOX_CLI_SHOW_PASSWORD = bool(getenv('TGBOX_CLI_SHOW_PASSWORD'))
 TGBOX_CLI_NOCOLOR = bool(getenv('TGBOX_CLI_NOCOLOR'))
 DEBUG_MODE = bool(getenv('TGBOX_CLI_DEBUG'))
 
+# Default limits of upload/download speed (e.g "10MB"), total
+# for all transfers. See --max-upload/download-speed options
+TGBOX_CLI_UPLOAD_SPEED = getenv('TGBOX_CLI_UPLOAD_SPEED')
+TGBOX_CLI_DOWNLOAD_SPEED = getenv('TGBOX_CLI_DOWNLOAD_SPEED')
+
 API_ID = getenv('TGBOX_CLI_API_ID')
 API_HASH = getenv('TGBOX_CLI_API_HASH')
 
@@ -29,7 +34,8 @@ if not all((API_ID, API_HASH)):
 # that will be hidden in format_dxbf/format_dxbf_multipart
 HIDDEN_CATTRS = [
     '__mp_total', '__mp_previous', '__mp_part',
-    '__mp_ver', '__mp_hash'
+    '__mp_ver', '__mp_hash', '__bundle_index',
+    '__bundle_ver', '__ref_id'
 ]
 
 # _TGBOX_CLI_COMPLETE will be present in env variables
@@ -3,3 +3,11 @@ from . import other
 from . import terminal
 from . import session
 from . import strings
+from . import transfer
+from . import cache
+from . import walk
+from . import bundle
+from . import preview
+from . import watch
+from . import connections
+from . import resume
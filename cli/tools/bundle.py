@@ -0,0 +1,280 @@
+"""
+Tools to pack many small files into one Box file (bundle)
+and to extract them back by ranged download.
+"""
+
+from typing import NamedTuple, Callable, Optional, AsyncGenerator
+from json import dumps, loads
+from zlib import compress, decompress
+from re import search as re_search
+from hashlib import sha256
+from inspect import isawaitable
+from os import utime
+
+from ..config import tgbox
+
+# Version of the bundle format, '__bundle_ver' CAttr
+BUNDLE_VERSION = b'\x01'
+
+# Max size of data in one bundle. It's kept in memory
+# until upload, so we don't want it to be too big
+BUNDLE_MAX_SIZE = 64_000_000
+
+# Max size of the raw (before compression) index. Index
+# is stored as CAttr, so it should fit into the Metadata
+BUNDLE_MAX_INDEX = 400_000
+
+
+class BundleMember(NamedTuple):
+    """One file in the bundle, item of the '__bundle_index'"""
+    path: str # Full file path (with name) in the Box
+    offset: int
+    length: int
+    mtime: float
+    sha256: str # SHA256 of the member data (hex)
+
+    @property
+    def name(self) -> str:
+        return self.path.replace('\\', '/').rsplit('/', 1)[-1]
+
+def pack_bundle_index(members: list) -> bytes:
+    """Will pack list of BundleMember to the '__bundle_index' CAttr"""
+    return compress(dumps([tuple(m) for m in members]).encode())
+
+def unpack_bundle_index(index: bytes) -> list:
+    """Will unpack '__bundle_index' CAttr to list of BundleMember"""
+    return [BundleMember(*m) for m in loads(decompress(index))]
+
+class BundleWriter:
+    """
+    This class collects small files into the one bundle
+    in memory. Every added file can have a callback that
+    will be called with Box ID of the uploaded bundle.
+
+    bundle = BundleWriter()
+    bundle.add('/home/user/a.txt', b'...', 1700000000.0)
+
+    if bundle.full:
+        data, index = bundle.pack()
+    """
+    def __init__(self):
+        self._data = []
+        self._members = []
+        self._callbacks = []
+
+        self._size = 0
+        self._index_size = 0
+
+    def __len__(self):
+        return len(self._members)
+
+    @property
+    def full(self) -> bool:
+        return self._size >= BUNDLE_MAX_SIZE\
+            or self._index_size >= BUNDLE_MAX_INDEX
+
+    @property
+    def callbacks(self) -> list:
+        return self._callbacks
+
+    def add(self, path: str, data: bytes, mtime: float,
+            callback: Optional[Callable]=None):
+        member = BundleMember(str(path), self._size,
+            len(data), mtime, sha256(data).hexdigest())
+
+        self._data.append(data)
+        self._members.append(member)
+
+        if callback:
+            self._callbacks.append(callback)
+
+        self._size += len(data)
+        # Approximate size of the member in JSON
+        self._index_size += len(member.path) + 116
+
+    def pack(self) -> tuple:
+        """
+        Will return bundle data and packed index. Members are
+        sorted by path, so the same files will make the same
+        bundle, in whatever order they were added.
+        """
+        order = sorted(range(len(self._members)),
+            key=lambda i: self._members[i].path)
+
+        data, members, offset = [], [], 0
+        for i in order:
+            members.append(self._members[i]._replace(offset=offset))
+            data.append(self._data[i])
+            offset += len(self._data[i])
+
+        return b''.join(data), pack_bundle_index(members)
+
+def match_member(member: BundleMember, sf) -> bool:
+    """
+    Will check file_name, file_path, min_size and max_size
+    filters of the SearchFilter against bundle member. All
+    other filters are for the bundle file itself.
+    """
+    # Will use Regex Search if 're' is included in Filters, "In" otherwise.
+    in_func = re_search if sf.in_filters['re'] else lambda p,s: p in s
+
+    for include, filter in ((True, sf.in_filters), (False, sf.ex_filters)):
+        for key, value in (('file_name', member.name), ('file_path', member.path)):
+            if filter[key]:
+                matched = any(in_func(p, value) for p in filter[key])
+                if matched != include:
+                    return False
+
+        if filter['min_size']:
+            if (member.length >= filter['min_size'][-1]) != include:
+                return False
+
+        if filter['max_size']:
+            if (member.length <= filter['max_size'][-1]) != include:
+                return False
+
+    return True
+
+class _MembersDone(tgbox.errors.InvalidFile):
+    """
+    Raised by the _MembersWriter when all members are written.
+    tgbox retries download on any other error, but not on this.
+    """
+
+class _MembersWriter:
+    """
+    File-like object for the DecryptedRemoteBoxFile.download(),
+    which writes bytes of the bundle (from start) to files of
+    members that overlap with them. Data of every member is
+    hashed. If stop is specified, download will be stopped
+    when bundle is written up to it.
+    """
+    def __init__(self, start: int, stop: Optional[int], targets: list):
+        self._pos = start
+        self._stop = stop
+        self._targets = targets # List of (member, file)
+        self._hashes = [sha256() for _ in targets]
+
+    def write(self, data: bytes):
+        data_start, data_end = self._pos, self._pos + len(data)
+
+        for (member, file), hash in zip(self._targets, self._hashes):
+            start = max(member.offset, data_start)
+            end = min(member.offset + member.length, data_end)
+
+            if start < end:
+                file.write(data[start-data_start:end-data_start])
+                hash.update(data[start-data_start:end-data_start])
+
+        self._pos = data_end
+
+        if self._stop and self._pos >= self._stop:
+            raise _MembersDone('All members are written')
+
+        return len(data)
+
+    def invalid(self) -> list:
+        """Will return members which data doesn't match their SHA256"""
+        return [
+            member for (member, _), hash in zip(self._targets, self._hashes)
+            if member.sha256 != hash.hexdigest()
+        ]
+
+async def extract_members(drbf, targets: list, progress_callback=None):
+    """
+    This coroutine will download only the range of bundle
+    (drbf) that contains requested members and write them.
+    Every member is verified by its SHA256 from the index.
+
+    Arguments:
+        drbf: DecryptedRemoteBoxFile:
+            Bundle file.
+
+        targets: list:
+            List of (BundleMember, outfile Path).
+
+        progress_callback: Callable, optional:
+            Will be called with (current, total) bytes
+            of the downloaded range.
+    """
+    # Download offset must be divisible by 524288
+    start = min(m.offset for m, _ in targets)
+    start -= start % 524288
+
+    end = max(m.offset + m.length for m, _ in targets)
+    # We stop download after the last member. Fast download
+    # doesn't close its connections on early exit, while slow
+    # one requests data chunk by chunk, so nothing is left
+    # running when we stop. If the last member is at the end
+    # of bundle, we don't need to stop, so use fast one.
+    stop = end if end < drbf.size else None
+
+    async def callback(current, total):
+        if progress_callback:
+            result = progress_callback(
+                min(current, end) - start, end - start)
+
+            if isawaitable(result):
+                await result
+
+    files = [(member, open(outfile, 'wb')) for member, outfile in targets]
+    writer = _MembersWriter(start, stop, files)
+    try:
+        if end > start:
+            try:
+                await drbf.download(
+                    outfile = writer,
+                    offset = start,
+                    progress_callback = callback,
+                    # Members are verified by their SHA256
+                    omit_hmac_check = True,
+                    use_slow_download = stop is not None
+                )
+            except _MembersDone:
+                await callback(end, end)
+
+        invalid = writer.invalid()
+    except BaseException:
+        invalid = None
+        raise
+    finally:
+        for _, file in files:
+            file.close()
+
+        if invalid != []: # Don't leave unverified data
+            for _, outfile in targets:
+                outfile.unlink(missing_ok=True)
+
+    if invalid:
+        raise tgbox.errors.InvalidFile(
+            f'Bundle ID={drbf.id} was modified! SHA256 of members '
+            f'{", ".join(m.path for m in invalid)} doesn\'t match. DO '
+             'NOT TRUST this bundle! Consider to review it & then purge!')
+
+    for member, outfile in targets:
+        utime(outfile, (member.mtime, member.mtime))
+
+async def search_bundled(dlb, sf) -> AsyncGenerator[tuple, None]:
+    """
+    This generator will yield (bundle DecryptedLocalBoxFile,
+    BundleMember) for every bundled file that matches sf
+    (see match_member()). Newer bundles are checked first,
+    and only the latest version of every file is yielded.
+    """
+    bundles_sf = tgbox.tools.SearchFilter(cattrs={'__bundle_index': b''})
+    bundles_sf.in_filters['scope'] = sf.in_filters['scope']
+
+    bundles = dlb.search_file(bundles_sf, cache_preview=False)
+    bundles = [dlbf async for dlbf in bundles]
+    bundles.sort(key=lambda dlbf: dlbf.id, reverse=True)
+
+    seen_paths = set()
+    for dlbf in bundles:
+        for member in unpack_bundle_index(dlbf.cattrs['__bundle_index']):
+            if member.path in seen_paths:
+                continue # Older version of this file
+
+            seen_paths.add(member.path)
+
+            if match_member(member, sf):
+                yield dlbf, member
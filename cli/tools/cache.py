@@ -0,0 +1,498 @@
+"""
+Encrypted (by the Box MainKey) cache class that is used
+to keep some local data between runs next to the LocalBox.
+"""
+
+from typing import Optional
+from pickle import loads, dumps
+from hashlib import sha256
+from hmac import new as hmac_new, compare_digest
+from pathlib import Path
+from time import monotonic
+from math import ceil, log
+from shutil import rmtree
+from secrets import token_hex
+from os import replace
+
+from ..config import tgbox
+if hasattr(tgbox, 'crypto'):
+    AES = tgbox.crypto.AESwState
+else:
+    # Autocompletion will create dummy tgbox object
+    # to omit useless imports. As AES will not be
+    # used in actual code, we can just set it to
+    # the None value.
+    AES = None
+
+
+def _seal(key: bytes, data: bytes) -> bytes:
+    """Will encrypt data with key and prepend HMAC of the result"""
+    encrypted = AES(key).encrypt(data)
+    mac_key = hmac_new(key, b'mac', sha256).digest()
+    return hmac_new(mac_key, encrypted, sha256).digest() + encrypted
+
+def _unseal(key: bytes, data: bytes) -> bytes:
+    """
+    Will check HMAC of data made by the _seal() and decrypt
+    it. We never unpickle anything that we didn't write.
+    """
+    mac, encrypted = data[:32], data[32:]
+    mac_key = hmac_new(key, b'mac', sha256).digest()
+
+    if not compare_digest(mac, hmac_new(mac_key, encrypted, sha256).digest()):
+        raise ValueError('Cache is corrupted or was changed')
+
+    return AES(key).decrypt(encrypted)
+
+class BoxCache:
+    """
+    This class is a simple dict-like storage which is
+    bound to the Box. Its file is placed in the same
+    directory as LocalBox and encrypted with key made
+    from the Box MainKey, so only the Box owner can
+    read it. Every cache has its own unique name.
+
+    cache = BoxCache(dlb, 'example')
+    cache['key'] = 'value'
+    cache.commit()
+    """
+    def __init__(self, dlb, name: str):
+        """
+        Arguments:
+            dlb: DecryptedLocalBox:
+                LocalBox to which this cache is bound.
+
+            name: str:
+                Name of the cache. Different caches of
+                one Box should have different names.
+        """
+        box_path = Path(dlb.tgbox_db.db_path)
+
+        self.name = name
+        self.enc_key = sha256(dlb.mainkey.key + name.encode()).digest()
+        self.file = box_path.parent / f'.{box_path.name}.{name}'
+
+        try:
+            state = open(self.file,'rb').read()
+            self.state = loads(_unseal(self.enc_key, state))
+        except Exception:
+            # File doesn't exist or can't be decrypted, e.g
+            # if it was corrupted. Cache is only an
+            # optimization, so we can start over.
+            self.state = {}
+
+    def __getitem__(self, key):
+        return self.state[key]
+
+    def __setitem__(self, key, value):
+        self.state[key] = value
+
+    def __delitem__(self, key):
+        del self.state[key]
+
+    def __contains__(self, key):
+        return key in self.state
+
+    def __len__(self):
+        return len(self.state)
+
+    def __repr__(self):
+        return f'<class {self.__class__.__name__}({self.file}), {len(self)} items>'
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def pop(self, key, default=None):
+        return self.state.pop(key, default)
+
+    def commit(self):
+        """Will write changes made to self.state to file in encrypted form"""
+        encrypted_state = _seal(self.enc_key, dumps(self.state))
+
+        # We write to temporary file firstly, so the
+        # cache will not be broken if we get killed
+        temp_file = self.file.with_name(self.file.name + '.tmp')
+        open(temp_file,'wb').write(encrypted_state)
+        temp_file.chmod(0o600)
+
+        replace(temp_file, self.file)
+
+class LoggedBoxCache(BoxCache):
+    """
+    This class is a BoxCache that on commit appends only
+    changed items to the log file next to the cache instead
+    of rewriting the whole cache. Log is merged into cache
+    file when it becomes bigger than the cache itself, so
+    commit is cheap even if cache has millions of items.
+
+    cache = LoggedBoxCache(dlb, 'example')
+    cache['key'] = 'value'
+    cache.commit() # Only 'key' is written
+    """
+    # We will not merge log smaller than this amount of bytes
+    COMPACT_MIN_SIZE = 1048576
+
+    def __init__(self, dlb, name: str):
+        super().__init__(dlb, name)
+
+        self.log_file = self.file.with_name(self.file.name + '.log')
+
+        self._changes = {} # Key -> (removed, value)
+        self._compact = False
+
+        try:
+            self._cache_size = self.file.stat().st_size
+        except FileNotFoundError:
+            self._cache_size = 0
+
+        self._log_size = self._replay()
+
+    def _replay(self) -> int:
+        """Will apply log records to self.state and return log size"""
+        try:
+            log = open(self.log_file,'rb').read()
+        except FileNotFoundError:
+            return 0
+
+        position = 0
+        while position < len(log):
+            size = int.from_bytes(log[position:position+4], 'big')
+            record = log[position+4:position+4+size]
+            try:
+                if len(record) != size:
+                    raise ValueError('Log record is incomplete')
+
+                changes = loads(_unseal(self.enc_key, record))
+            except Exception:
+                # Last record can be written partially if we
+                # got killed. We will drop it (and anything
+                # after) by merging log on the next commit.
+                self._compact = True
+                break
+
+            for key, (removed, value) in changes.items():
+                if removed:
+                    self.state.pop(key, None)
+                else:
+                    self.state[key] = value
+
+            position += 4 + size
+
+        return len(log)
+
+    def __setitem__(self, key, value):
+        self.state[key] = value
+        self._changes[key] = (False, value)
+
+    def __delitem__(self, key):
+        del self.state[key]
+        self._changes[key] = (True, None)
+
+    def pop(self, key, default=None):
+        if key in self.state:
+            self._changes[key] = (True, None)
+        return self.state.pop(key, default)
+
+    def commit(self):
+        """Will append changes to log or merge log into cache file"""
+        if not self._changes and not self._compact:
+            return
+
+        if self._compact or self._log_size > max(self._cache_size, self.COMPACT_MIN_SIZE):
+            super().commit()
+            # If we get killed right here, log will be applied
+            # on the cache that already has all of its changes
+            self.log_file.unlink(missing_ok=True)
+
+            self._cache_size = self.file.stat().st_size
+            self._log_size = 0
+            self._compact = False
+        else:
+            record = _seal(self.enc_key, dumps(self._changes))
+            record = len(record).to_bytes(4, 'big') + record
+
+            with open(self.log_file,'ab') as log:
+                log.write(record)
+            self.log_file.chmod(0o600)
+
+            self._log_size += len(record)
+
+        self._changes.clear()
+
+def remove_box_caches(dlb):
+    """This function will remove all BoxCache files of the Box"""
+    box_path = Path(dlb.tgbox_db.db_path)
+
+    for cache_file in box_path.parent.glob(f'.{box_path.name}.*'):
+        if cache_file.is_dir(): # e.g PreviewCache
+            rmtree(cache_file, ignore_errors=True)
+        else:
+            cache_file.unlink(missing_ok=True)
+
+class PreviewCache:
+    """
+    This class is an on-disk cache of file previews and
+    durations, keyed by the file content. Unlike BoxCache,
+    every item is a separate (encrypted) file, as there
+    can be a lot of them and we need only few at once.
+
+    cache = PreviewCache(dlb)
+    cache.set(content_key, (b'<JPEG>', 0))
+    cache.get(content_key) # (b'<JPEG>', 0)
+    """
+    def __init__(self, dlb):
+        box_path = Path(dlb.tgbox_db.db_path)
+
+        self.enc_key = sha256(dlb.mainkey.key + b'previews').digest()
+        self.dir = box_path.parent / f'.{box_path.name}.previews'
+
+    def _item_path(self, key: bytes) -> Path:
+        # Names are keyed too, so they will not leak checksums of files
+        return self.dir / hmac_new(self.enc_key, key, sha256).hexdigest()
+
+    def get(self, key: bytes):
+        """Will return cached value or None if there is no such"""
+        try:
+            item = open(self._item_path(key),'rb').read()
+            return loads(_unseal(self.enc_key, item))
+        except Exception:
+            return None
+
+    def set(self, key: bytes, value):
+        self.dir.mkdir(mode=0o700, exist_ok=True)
+
+        item_path = self._item_path(key)
+        encrypted_item = _seal(self.enc_key, dumps(value))
+
+        # Same as in BoxCache, item will be never written partially. The
+        # same item can be written from many threads, so name is unique
+        temp_file = item_path.with_name(f'{item_path.name}.{token_hex(4)}.tmp')
+        open(temp_file,'wb').write(encrypted_item)
+        temp_file.chmod(0o600)
+
+        replace(temp_file, item_path)
+
+class UploadJournal:
+    """
+    This class is a local record of files that we uploaded
+    to the Box, keyed by resolved local path. We use it on
+    repeated uploads to decide in memory if file is changed
+    by its stat (size, mtime_ns, inode), without making
+    any per-file requests to the LocalBox.
+
+    journal = UploadJournal(dlb)
+    await journal.load()
+
+    entry = UploadJournal.make_entry(remote_path, path.stat())
+    if journal.check(path, entry) is True:
+        ... # File is unchanged, skip it
+    """
+    # Journal will be written to disk not more than once per this
+    # amount of seconds (and on close). Only new records are
+    # appended to the log on commit, see LoggedBoxCache.
+    COMMIT_INTERVAL = 60
+
+    def __init__(self, dlb):
+        self._dlb = dlb
+        self._cache = LoggedBoxCache(dlb, 'upload_journal')
+
+        self._box_ids = set()
+        self._last_commit = monotonic()
+
+    async def load(self):
+        """
+        Will load IDs of all LocalBox files in one query. We
+        need them to ignore records of files that were
+        removed from the Box after upload.
+        """
+        sql_tuple = ('SELECT ID FROM FILES', ())
+        async for row in self._dlb.tgbox_db.FILES.select(sql_tuple):
+            self._box_ids.add(row[0])
+
+    @staticmethod
+    def make_entry(remote_path, stat) -> tuple:
+        """This function will make journal entry from the os.stat_result"""
+        return (str(remote_path), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def check(self, path, entry: tuple) -> Optional[bool]:
+        """
+        Will return True if file under path was uploaded
+        and wasn't changed since, False if it was changed
+        and None if journal doesn't know about this file.
+        """
+        record = self._cache.get(str(path))
+
+        if not record or record[1] not in self._box_ids:
+            return None
+
+        if record[0][0] != entry[0]: # Remote path is different
+            return None
+
+        return record[0] == entry
+
+    def record(self, path, entry: tuple, file_id: int):
+        """Will record that file under path is uploaded as file_id"""
+        self._cache[str(path)] = (entry, file_id)
+        self._box_ids.add(file_id)
+
+        if monotonic() - self._last_commit > self.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self._cache.commit()
+        self._last_commit = monotonic()
+
+class ContentIndex:
+    """
+    This class is a local index of sha256 checksums of files
+    that we uploaded to the Box, so we can find files with
+    the same content before upload. We also keep checksums
+    of local files by their stat, so unchanged files will
+    not be read and hashed again on repeated uploads.
+
+    index = ContentIndex(dlb)
+    await index.load()
+
+    if index.has_size(path.stat().st_size):
+        file_id = index.get(sha256(path.read_bytes()).digest())
+    """
+    # Same as in the UploadJournal
+    COMMIT_INTERVAL = 60
+
+    def __init__(self, dlb):
+        self._dlb = dlb
+        self._cache = BoxCache(dlb, 'content_index')
+
+        self._hashes = self._cache.state.setdefault('hashes', {}) # Hash -> (ID, size)
+        self._local = self._cache.state.setdefault('local', {}) # Path -> (stat, hash)
+
+        self._box_ids = set()
+        self._sizes = set()
+        self._last_commit = monotonic()
+
+    async def load(self):
+        """
+        Will load IDs of all LocalBox files in one query, so
+        we will ignore checksums of removed files, and make
+        a set of sizes of files that are still in the Box.
+        """
+        sql_tuple = ('SELECT ID FROM FILES', ())
+        async for row in self._dlb.tgbox_db.FILES.select(sql_tuple):
+            self._box_ids.add(row[0])
+
+        for file_id, size in self._hashes.values():
+            if file_id in self._box_ids:
+                self._sizes.add(size)
+
+    def has_size(self, size: int) -> bool:
+        """
+        Will return True if Box has indexed file of the same
+        size. Only such files can be duplicates, so there is
+        no need to hash any other.
+        """
+        return size in self._sizes
+
+    def get(self, content_hash: bytes) -> Optional[int]:
+        """Will return ID of the Box file with the same content (if any)"""
+        record = self._hashes.get(content_hash)
+
+        if record and record[0] in self._box_ids:
+            return record[0]
+
+    def add(self, content_hash: bytes, size: int, file_id: int):
+        """Will record that file_id has content with content_hash"""
+        self._hashes[content_hash] = (file_id, size)
+
+        self._box_ids.add(file_id)
+        self._sizes.add(size)
+
+        if monotonic() - self._last_commit > self.COMMIT_INTERVAL:
+            self.commit()
+
+    def local_hash(self, path, stat) -> Optional[bytes]:
+        """Will return checksum of local file if it wasn't changed"""
+        record = self._local.get(str(path))
+        stat = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+        if record and record[0] == stat:
+            return record[1]
+
+    def set_local_hash(self, path, stat, content_hash: bytes):
+        stat = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        self._local[str(path)] = (stat, content_hash)
+
+    def commit(self):
+        self._cache.commit()
+        self._last_commit = monotonic()
+
+class FingerprintFilter:
+    """
+    This class is a Bloom filter of fingerprints of all
+    LocalBox files. It's loaded in one query, so we can
+    tell that file is not in the Box without LocalBox
+    request per file. If filter says that file *may be*
+    in the Box, we should still check it in LocalBox.
+
+    fingerprints = FingerprintFilter(dlb)
+    await fingerprints.load()
+
+    if fingerprint in fingerprints:
+        dlbf = await dlb.get_file(fingerprint=fingerprint)
+    """
+    # Probability that filter will say "may be in the Box" on
+    # the new file. It takes ~10 bits of memory per fingerprint
+    FALSE_POSITIVE_RATE = 0.01
+
+    # Filter will be sized for this amount of fingerprints
+    # at least, as we also add fingerprints of uploaded files
+    MIN_CAPACITY = 1_000_000
+
+    def __init__(self, dlb):
+        self._dlb = dlb
+
+        self._bits = None
+        self._size = 0 # Size of filter in bits
+        self._hashes = 0
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        if self._bits is None:
+            return True # Filter is not loaded, we don't know
+
+        return all(self._bits[p >> 3] & (1 << (p & 7))
+            for p in self._positions(fingerprint))
+
+    async def load(self):
+        """
+        Will make filter from fingerprints of all LocalBox
+        files in one query. Filter is sized for twice as
+        many files, so it will not overfill on upload.
+        """
+        files_total = await self._dlb.tgbox_db.FILES.count_rows()
+        capacity = max(files_total * 2, self.MIN_CAPACITY)
+
+        self._size = ceil(-capacity * log(self.FALSE_POSITIVE_RATE) / log(2) ** 2)
+        self._hashes = max(round(self._size / capacity * log(2)), 1)
+        self._bits = bytearray(self._size // 8 + 1)
+
+        sql_tuple = ('SELECT FINGERPRINT FROM FILES', ())
+        async for row in self._dlb.tgbox_db.FILES.select(sql_tuple):
+            if row[0]: # Can be NULL on files from very old Boxes
+                self.add(row[0])
+
+    def _positions(self, fingerprint: bytes):
+        # Fingerprint is already a sha256 hash, so instead of
+        # k different hash functions we can combine two parts
+        # of it (double hashing) to get positions of bits.
+        h1 = int.from_bytes(fingerprint[:8], 'big')
+        h2 = int.from_bytes(fingerprint[8:16], 'big') | 1
+
+        for i in range(self._hashes):
+            yield (h1 + i * h2) % self._size
+
+    def add(self, fingerprint: bytes):
+        """Will add fingerprint of the new Box file to filter"""
+        if self._bits is None:
+            return
+
+        for p in self._positions(fingerprint):
+            self._bits[p >> 3] |= 1 << (p & 7)
@@ -0,0 +1,217 @@
+"""Tools that manage connections to the Telegram"""
+
+from collections import defaultdict
+from inspect import signature
+from weakref import WeakSet, WeakKeyDictionary, WeakValueDictionary
+
+from ..config import tgbox
+
+# Parameters of the private fastelethon functions that we
+# replace or call. If installed tgbox has other, we will
+# not install the SenderPool (see SenderPool.install)
+FASTELETHON_SIGNATURES = {
+    ('ParallelTransferrer', '_create_sender'): ('self',),
+    ('ParallelTransferrer', '_get_connection_count'): (
+        'file_size', 'max_count', 'full_size'),
+    ('ParallelTransferrer', 'init_upload'): (
+        'self', 'file_id', 'file_size', 'part_size_kb', 'connection_count'),
+    ('ParallelTransferrer', 'download'): (
+        'self', 'file', 'file_size', 'part_size_kb', 'offset', 'connection_count'),
+    ('UploadSender', 'disconnect'): ('self',),
+    ('DownloadSender', 'disconnect'): ('self',)
+}
+
+
+def _fastelethon_supported(fastelethon) -> bool:
+    """Will return True if fastelethon matches FASTELETHON_SIGNATURES"""
+    for (class_name, name), parameters in FASTELETHON_SIGNATURES.items():
+        try:
+            function = getattr(getattr(fastelethon, class_name), name)
+            if tuple(signature(function).parameters) != parameters:
+                return False
+        except (AttributeError, TypeError, ValueError):
+            return False
+
+    return True
+
+
+class SenderPool:
+    """
+    This class is a pool of connected MTProto senders (one
+    sender is one connection) per data center. By default,
+    tgbox opens new connections for every transferred file
+    (up to 20, by file size) and closes them on finish, so
+    with many files a lot of time is spent on connect (and
+    on the auth export for files from other DC).
+
+    With the pool installed, connections are taken from it
+    and returned back after transfer, so they are reused
+    by the next files. File will get its share of the pool
+    size (divided by the amount of transfers in flight, one
+    connection at least), so running transfers share it.
+
+    senders = SenderPool(size=8)
+    senders.install()
+    ... # Upload or download files
+    await senders.close()
+
+    Transfers are tracked by weak references, so transfer
+    that failed before it released its senders (tgbox does
+    not close them on upload error) stops to take share of
+    the pool as soon as its ParallelTransferrer is freed.
+    """
+    def __init__(self, size: int):
+        self.size = size
+
+        self._idle = defaultdict(list) # (client, dc_id) -> list of senders
+        self._transfers = defaultdict(WeakSet) # (client, dc_id) -> ParallelTransferrers
+        self._auth_keys = {} # (client, dc_id) -> AuthKey
+
+        self._owners = WeakValueDictionary() # Sender -> ParallelTransferrer
+        self._held = WeakKeyDictionary() # ParallelTransferrer -> amount of senders
+
+        self._originals = None
+
+    def _busy(self, key: tuple) -> int:
+        """Will return amount of senders that are in use"""
+        return sum(
+            held for transferrer, held in self._held.items()
+            if (transferrer.client, transferrer.dc_id) == key
+        )
+
+    def _share(self, transferrer, wanted: int) -> int:
+        key = (transferrer.client, transferrer.dc_id)
+        self._transfers[key].add(transferrer)
+
+        return max(min(wanted, self.size // len(self._transfers[key])), 1)
+
+    def _finish(self, transferrer):
+        key = (transferrer.client, transferrer.dc_id)
+        self._transfers[key].discard(transferrer)
+
+    async def _acquire(self, transferrer, create_sender):
+        key = (transferrer.client, transferrer.dc_id)
+
+        # Authorization is exported to other DC only once
+        if not transferrer.auth_key:
+            transferrer.auth_key = self._auth_keys.get(key)
+
+        sender, idle = None, self._idle[key]
+
+        while idle and not sender:
+            sender = idle.pop()
+            if not sender.is_connected():
+                sender = None
+
+        if not sender:
+            sender = await create_sender(transferrer)
+            self._auth_keys[key] = transferrer.auth_key
+
+        self._owners[sender] = transferrer
+        self._held[transferrer] = self._held.get(transferrer, 0) + 1
+
+        return sender
+
+    async def _release(self, sender):
+        transferrer = self._owners.pop(sender, None)
+
+        if transferrer is None: # Sender is not from this pool
+            await sender.disconnect()
+            return
+
+        key = (transferrer.client, transferrer.dc_id)
+
+        self._held[transferrer] -= 1
+        if not self._held[transferrer]: # Transfer is finished
+            del self._held[transferrer]
+            self._finish(transferrer)
+
+        keep = self._originals and sender.is_connected()\
+            and len(self._idle[key]) + self._busy(key) < self.size
+
+        if keep:
+            self._idle[key].append(sender)
+        else:
+            await sender.disconnect()
+
+    def install(self) -> bool:
+        """
+        Will make tgbox fast upload & download use this pool.
+        We replace private functions of the tgbox.fastelethon,
+        so if they are not as we expect (e.g tgbox is updated)
+        pool will not be installed and False will be returned.
+        """
+        fastelethon = getattr(tgbox, 'fastelethon', None)
+
+        if not _fastelethon_supported(fastelethon):
+            return False
+
+        transferrer = fastelethon.ParallelTransferrer
+
+        self._originals = (
+            transferrer._create_sender,
+            transferrer.init_upload,
+            transferrer.download,
+            fastelethon.UploadSender.disconnect,
+            fastelethon.DownloadSender.disconnect
+        )
+        create_sender, init_upload, download = self._originals[:3]
+
+        async def _create_sender(self_):
+            return await self._acquire(self_, create_sender)
+
+        async def _init_upload(self_, file_id, file_size,
+                part_size_kb=None, connection_count=None):
+            connection_count = connection_count or self._share(
+                self_, transferrer._get_connection_count(file_size))
+
+            try:
+                return await init_upload(self_, file_id,
+                    file_size, part_size_kb, connection_count)
+            except BaseException:
+                self._finish(self_)
+                raise
+
+        async def _download(self_, file, file_size,
+                part_size_kb=None, offset=None, connection_count=None):
+            connection_count = connection_count or self._share(
+                self_, transferrer._get_connection_count(file_size))
+            try:
+                async for data in download(self_, file, file_size,
+                        part_size_kb, offset, connection_count):
+                    yield data
+            finally: # Download can fail or be stopped by caller
+                self._finish(self_)
+
+        async def _upload_disconnect(self_):
+            if self_.previous: # Wait for the last part
+                await self_.previous
+            await self._release(self_.sender)
+
+        async def _download_disconnect(self_):
+            await self._release(self_.sender)
+
+        transferrer._create_sender = _create_sender
+        transferrer.init_upload = _init_upload
+        transferrer.download = _download
+
+        fastelethon.UploadSender.disconnect = _upload_disconnect
+        fastelethon.DownloadSender.disconnect = _download_disconnect
+
+        return True
+
+    async def close(self):
+        """Will restore tgbox and close all idle connections"""
+        if self._originals:
+            fastelethon = tgbox.fastelethon
+            transferrer = fastelethon.ParallelTransferrer
+
+            transferrer._create_sender, transferrer.init_upload,\
+                transferrer.download, fastelethon.UploadSender.disconnect,\
+                fastelethon.DownloadSender.disconnect = self._originals
+
+            self._originals = None
+
+        for idle in self._idle.values():
+            while idle:
+                await idle.pop().disconnect()
@@ -390,3 +390,27 @@ def format_dxbf_message(
        f' {time}\n |\n [W0b]@[X] Message: {text}'
     )
     return colorize(formatted)
+
+def format_bundle_member(dlbf, member) -> str:
+    """
+    This will format file packed into bundle, see
+    the tools.bundle.BundleMember for details.
+    """
+    salt = urlsafe_b64encode(dlbf.file_salt.salt).decode()
+    idsalt = f'[[M1b]{dlbf.id}[X]:[X1b]{salt[:12]}[X]]'
+
+    try:
+        name = click.format_filename(member.name)
+    except UnicodeDecodeError:
+        name = '[R0b][Unable to display][X]'
+
+    size = f'[G0b]{format_bytes(member.length)}[X]'
+    time = datetime.fromtimestamp(member.mtime).strftime('%d/%m/%y, %H:%M:%S')
+
+    formatted = (
+       f'\nFile: {idsalt} [W0b]{name}[X]\n'
+       f'Path: {split_string(member.path, 6)}\n'
+       f'Size: {size}({member.length}), bundled in [W0b]{dlbf.file_name}[X]\n'
+       f'* Modified at [C0b]{time}[X]\n'
+    )
+    return colorize(formatted)
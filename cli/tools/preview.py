@@ -0,0 +1,214 @@
+"""
+Tools to make previews (thumbnails) and durations of
+media files on a thread pool, ahead of their upload.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from asyncio import get_running_loop, shield, gather
+from subprocess import run as subprocess_run, PIPE
+from mimetypes import guess_type
+from hashlib import sha256
+from pathlib import Path
+from io import BytesIO
+from re import search as re_search
+from os import cpu_count
+
+from .cache import PreviewCache
+from ..config import tgbox
+
+# Every preview is a ffmpeg call, which is mostly CPU-bound. Threads
+# only wait for the ffmpeg process, so we don't need a process pool
+PREVIEW_WORKERS = cpu_count() or 1
+
+# We make previews ahead of upload only for this amount
+# of files per worker, so they will not pile up in memory
+PREVIEW_AHEAD = 4
+
+
+
+def _content_key(file_path: Path) -> bytes:
+    """
+    This function will make the PreviewCache key, which
+    is a sha256 of the whole file. Files that differ only
+    in the middle will not share the same preview.
+    """
+    content_key = sha256()
+
+    with open(file_path, 'rb') as f:
+        while (block := f.read(8_000_000)):
+            content_key.update(block)
+
+    return content_key.digest()
+
+def _media_type(file_path: Path) -> str:
+    """Will return 'image', 'audio', 'video' or '' by file extension"""
+    mime = guess_type(str(file_path))[0] or ''
+    return mime.split('/')[0]
+
+def _extract_media(file_path: str, with_duration: bool) -> tuple:
+    """
+    This function is executed in the thread pool. It will
+    make (preview, duration) of media file with the same
+    ffmpeg calls as in the tgbox.tools make_media_preview
+    and get_media_duration. Empty values mean failure.
+    """
+    ffmpeg = str(tgbox.defaults.FFMPEG)
+
+    preview_args = [
+        ffmpeg, '-i', file_path, '-frames:v', '1', '-filter:v', 'scale=128:-1',
+        '-an', '-loglevel', 'quiet', '-q:v', '2', '-f', 'mjpeg', 'pipe:1'
+    ]
+    try:
+        preview = subprocess_run(preview_args, capture_output=True).stdout
+    except OSError: # e.g ffmpeg is not installed
+        return b'', 0
+
+    duration = 0
+
+    if with_duration:
+        stderr = subprocess_run([ffmpeg, '-i', file_path], stderr=PIPE).stderr
+        duration_match = re_search(rb'Duration: (\d+):(\d+):(\d+)', stderr)
+
+        if duration_match:
+            h, m, s = (int(i) for i in duration_match.groups())
+            duration = h * 60**2 + m * 60 + s
+
+    return preview, duration
+
+class PreviewMaker:
+    """
+    This class makes previews & durations of media files
+    on a thread pool and caches them on disk by the file
+    content (see PreviewCache), so re-uploads (even with
+    --force-update) will never make them again.
+
+    Files are sent to it by prefetch() as soon as they are
+    found, and tgbox picks results on the prepare_file().
+    The tgbox has no option to accept ready preview, so
+    on install() we replace its media functions with ours.
+
+    If ContentIndex is specified, we will take checksums
+    of unchanged files from it instead of hashing them,
+    and will save ours, so deduplication can reuse them.
+
+    previews = PreviewMaker(dlb)
+    previews.install()
+
+    previews.prefetch(path) # Work will be started in background
+    await dlb.prepare_file(open(path,'rb'), ...)
+
+    await previews.close()
+    """
+    def __init__(self, dlb, max_workers: int=PREVIEW_WORKERS, index=None):
+        self._cache = PreviewCache(dlb)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._index = index
+
+        self._max_ahead = max_workers * PREVIEW_AHEAD
+        self._pending = {} # File path -> Task of (preview, duration)
+
+        self._originals = None
+
+    async def _content_key(self, file_path: Path) -> bytes:
+        loop = get_running_loop()
+        stat = await loop.run_in_executor(None, file_path.stat)
+
+        if self._index and (key := self._index.local_hash(file_path, stat)):
+            return key
+
+        key = await loop.run_in_executor(None, _content_key, file_path)
+
+        if self._index:
+            self._index.set_local_hash(file_path, stat, key)
+
+        return key
+
+    async def _extract(self, file_path: Path) -> tuple:
+        loop = get_running_loop()
+
+        key = await self._content_key(file_path)
+        cached = await loop.run_in_executor(None, self._cache.get, key)
+
+        if cached is not None:
+            return cached
+
+        with_duration = _media_type(file_path) != 'image'
+
+        result = await loop.run_in_executor(
+            self._executor, _extract_media, str(file_path), with_duration)
+
+        await loop.run_in_executor(None, self._cache.set, key, result)
+        return result
+
+    def _submit(self, file_path: str):
+        task = get_running_loop().create_task(self._extract(Path(file_path)))
+        self._pending[file_path] = task
+
+        task.add_done_callback(lambda _: self._pending.pop(file_path, None))
+        return task
+
+    def prefetch(self, file_path: Path):
+        """
+        Will start to make preview of file in background, if
+        it's a media (by extension) and we are not too far
+        ahead of upload. Otherwise it will be made on demand.
+        """
+        file_path = str(file_path)
+
+        if file_path in self._pending or len(self._pending) >= self._max_ahead:
+            return
+
+        if _media_type(file_path) in ('image', 'audio', 'video'):
+            self._submit(file_path)
+
+    async def get(self, file_path) -> tuple:
+        """Will return (preview, duration) of the file"""
+        file_path = str(file_path)
+        task = self._pending.get(file_path) or self._submit(file_path)
+
+        # Task can be awaited by preview and duration at the same
+        # time, so one cancelled caller should not cancel it
+        return await shield(task)
+
+    async def make_media_preview(self, file_path, x: int=128, y: int=-1):
+        """Replacement for the tgbox.tools.make_media_preview"""
+        preview, _ = await self.get(file_path)
+
+        if not preview:
+            raise tgbox.errors.PreviewImpossible('Can\'t make thumbnail')
+
+        return BytesIO(preview)
+
+    async def get_media_duration(self, file_path) -> int:
+        """Replacement for the tgbox.tools.get_media_duration"""
+        _, duration = await self.get(file_path)
+
+        if not duration:
+            raise tgbox.errors.DurationImpossible('Can\'t get media duration')
+
+        return duration
+
+    def install(self):
+        """Will make tgbox prepare_file() use this PreviewMaker"""
+        self._originals = (
+            tgbox.api.local.make_media_preview,
+            tgbox.api.local.get_media_duration
+        )
+        tgbox.api.local.make_media_preview = self.make_media_preview
+        tgbox.api.local.get_media_duration = self.get_media_duration
+
+    async def close(self):
+        """Will restore tgbox functions and stop the thread pool"""
+        if self._originals:
+            tgbox.api.local.make_media_preview,\
+                tgbox.api.local.get_media_duration = self._originals
+
+            self._originals = None
+
+        tasks = tuple(self._pending.values())
+
+        for task in tasks:
+            task.cancel()
+
+        await gather(*tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
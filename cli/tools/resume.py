@@ -0,0 +1,175 @@
+"""Tools that make interrupted downloads resumable"""
+
+from hmac import HMAC
+from json import dumps, loads
+from math import ceil
+from os import replace, fsync
+from pathlib import Path
+from time import monotonic
+from typing import BinaryIO, Callable, Optional
+
+# Downloads can be resumed only from offset that is
+# divisible by this, so we record offsets rounded to it
+BLOCK_SIZE = 524288
+
+
+class ResumeRecord:
+    """
+    This class is a small sidecar file that is placed next
+    to the file being downloaded ("{name}.tgbox-resume").
+    It records which parts of the file are finished and
+    verified, and how many bytes of parts that are in
+    progress are written. Parts can be downloaded out of
+    order (and at the same time) into the preallocated
+    file, but every part is written sequentially, so its
+    offset is enough to resume it from where it stopped.
+
+    Regular (not Multipart) file is recorded as one part.
+
+    record = ResumeRecord(outfile, file_id, total_size)
+    if not record.load(): # Will be False on new download
+        ...
+    offset = record.resume_offset(part, part_size)
+    ... # Download part from offset with record.track(...)
+    record.mark(part) # Part is finished and verified
+    ...
+    record.remove() # Download is finished
+
+    Record belongs to the file ID and size, so it will not
+    be loaded if other file is downloaded to the same path.
+    """
+    SUFFIX = '.tgbox-resume'
+
+    # Min amount of seconds between record writes
+    SAVE_INTERVAL = 5
+
+    def __init__(self, outfile: Path, file_id: int, size: int):
+        self.file = outfile.with_name(outfile.name + self.SUFFIX)
+
+        self.file_id = file_id
+        self.size = size
+
+        self.parts = set()
+        self.offsets = {} # Part -> written bytes (by BLOCK_SIZE)
+
+    def load(self) -> bool:
+        """Will return True if record of this download exists"""
+        try:
+            state = loads(self.file.read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+
+        if state.get('id') != self.file_id or state.get('size') != self.size:
+            return False
+
+        self.parts = set(state.get('parts', ()))
+        self.offsets = {
+            int(part): offset
+            for part, offset in state.get('offsets', {}).items()
+        }
+        return True
+
+    def save(self):
+        state = {
+            'id': self.file_id,
+            'size': self.size,
+            'parts': sorted(self.parts),
+            'offsets': {
+                str(part): offset
+                for part, offset in self.offsets.items()
+            }
+        }
+        # We write to temporary file and then replace
+        # record, so it's never left half-written
+        temp_file = self.file.with_name(self.file.name + '.tmp')
+        temp_file.write_text(dumps(state))
+        replace(temp_file, self.file)
+
+    def resume_offset(self, part: int, part_size: int) -> int:
+        """
+        Will return offset (from the part start) of the
+        first block of part that is not written yet.
+        """
+        # If all blocks are written but part is not marked
+        # as finished, it wasn't verified. We will download
+        # the last block again, so tgbox will check HMAC
+        last_block = max(ceil(part_size / BLOCK_SIZE) - 1, 0)
+        written = self.offsets.get(part, 0) // BLOCK_SIZE
+        return min(written, last_block) * BLOCK_SIZE
+
+    def written(self, part: int, current: int, total: int):
+        """
+        Will record that first current bytes of part with
+        size of total bytes are written (but not verified).
+        """
+        if current >= total:
+            written = total
+        else:
+            written = current // BLOCK_SIZE * BLOCK_SIZE
+
+        self.offsets[part] = max(self.offsets.get(part, 0), written)
+
+    def track(
+            self, part: int, outfile: BinaryIO,
+            progress_callback: Optional[Callable]=None) -> Callable:
+        """
+        Will wrap progress_callback of the part download, so
+        written bytes are recorded. It expects callback to
+        be called with (current, total) bytes of the part
+        after data is written to the outfile.
+
+        outfile is flushed to disk before every record write,
+        so bytes are never recorded before their data.
+        """
+        last_save = monotonic()
+
+        def callback(current, total):
+            nonlocal last_save
+
+            self.written(part, current, total)
+
+            if monotonic() - last_save >= self.SAVE_INTERVAL:
+                outfile.flush()
+                fsync(outfile.fileno())
+
+                self.save()
+                last_save = monotonic()
+
+            if progress_callback:
+                return progress_callback(current, total)
+
+        return callback
+
+    def mark(self, part: int):
+        """Will record that part is finished and verified"""
+        self.parts.add(part)
+        self.offsets.pop(part, None)
+        self.save()
+
+    def remove(self):
+        self.file.unlink(missing_ok=True)
+
+
+def make_hmac_state(drbf, file: BinaryIO, start: int, length: int) -> Optional[HMAC]:
+    """
+    Will return HMAC state of the drbf updated with length
+    bytes of file from the start position. It's needed to
+    verify file that is downloaded from offset if we can't
+    give tgbox the outfile to read (e.g if file is a
+    Multipart part in the middle of the output file).
+    """
+    if not drbf.has_hmac_sha256:
+        return None
+
+    hmac_state = HMAC(drbf.hmackey.key, digestmod='sha256')
+    file.seek(start)
+
+    while length > 0:
+        chunk = file.read(min(length, 128000000))
+        if not chunk:
+            break
+
+        hmac_state.update(chunk)
+        length -= len(chunk)
+
+    return hmac_state
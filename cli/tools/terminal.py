@@ -2,10 +2,14 @@
 
 import click
 
+from typing import Callable, Optional
+from collections import deque
+from time import monotonic
 from platform import system as platform_system
 from re import finditer as re_finditer
 from os import system as os_system
 
+from .convert import format_bytes
 from ..config import TGBOX_CLI_NOCOLOR
 
 
@@ -218,6 +222,197 @@ class ProgressBar:
 
             self.last_id = current
 
+class TransferProgress:
+    """
+    This is an aggregated progress of many transfers. It
+    doesn't make counter per file (as ProgressBar does),
+    instead one line shows files done, bytes, speed and
+    ETA of the whole job, and lines below it show top
+    (biggest) active transfers. Redraws are throttled.
+
+    If output is not a TTY (e.g redirected to the log)
+    or plain is True, progress is echoed as plain line
+    once per PLAIN_INTERVAL seconds.
+
+    progress = TransferProgress(manager, 'Upload')
+
+    # Size is optional, but then file will be counted
+    # in the totals only when its transfer is started
+    progress_callback = progress.track(file_name, file_size)
+    ... # File can wait in the queue for a while
+
+    tgbox.api.DecryptedRemoteBox.push_file(
+        ..., progress_callback=progress_callback
+    )
+    progress.close()
+    """
+    # Min amount of seconds between redraws
+    REFRESH = 0.25
+
+    # Amount of seconds between lines in plain mode
+    PLAIN_INTERVAL = 10
+
+    # Transfer is not shown if there was no progress
+    # on it for this amount of seconds (e.g failed)
+    STALE = 60
+
+    # Speed is measured over this amount of seconds
+    SPEED_WINDOW = 10
+
+    def __init__(self, manager, name: str, top: int=5, plain: bool=False):
+        self.name = name
+        self.top = top
+        self.manager = manager
+        self.plain = plain or not getattr(manager, 'enabled', False)
+
+        self.files_started, self.files_done = 0, 0
+        self.bytes_total, self.bytes_done = 0, 0
+
+        self._tracked = {} # Callback -> [desc, current, total, last update]
+        self._active = {} # The same, but only for started transfers
+
+        self._samples = deque() # (time, bytes_done)
+        self._last_refresh = 0
+        self._bars = []
+
+    def track(self, desc: str, total: Optional[int]=None) -> Callable:
+        """
+        Will return progress_callback of one transfer. It
+        expects to be called with (current, total) bytes.
+
+        If total is specified, it's counted right away, so
+        files in queue are included into the bytes total
+        and ETA. Real total of the first call replaces it.
+        """
+        transfer = [desc, 0, total or 0, None]
+
+        def callback(current, total):
+            if callback not in self._tracked:
+                return # Finished or untracked
+
+            if transfer[3] is None: # Transfer is started
+                self.bytes_total += total - transfer[2]
+                transfer[2] = total
+                self._active[callback] = transfer
+
+            self.bytes_done += current - transfer[1]
+            transfer[1], transfer[3] = current, monotonic()
+
+            if current >= total:
+                del self._tracked[callback]
+                del self._active[callback]
+                self.files_done += 1
+
+            self._refresh()
+
+        self._tracked[callback] = transfer
+
+        self.files_started += 1
+        self.bytes_total += transfer[2]
+
+        return callback
+
+    def untrack(self, callback: Callable):
+        """
+        Will forget transfer of callback that will not be
+        finished (e.g it's skipped or failed), so its bytes
+        that are left are not counted in the total.
+        """
+        transfer = self._tracked.pop(callback, None)
+        if not transfer:
+            return
+
+        self._active.pop(callback, None)
+
+        self.files_started -= 1
+        self.bytes_total -= transfer[2] - transfer[1]
+
+    @staticmethod
+    def _format_time(seconds: float) -> str:
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f'{hours:02}:{minutes:02}:{seconds:02}'
+
+    def _speed(self, now: float) -> float:
+        self._samples.append((now, self.bytes_done))
+
+        while now - self._samples[0][0] > self.SPEED_WINDOW:
+            self._samples.popleft()
+
+        elapsed = now - self._samples[0][0]
+        if not elapsed:
+            return 0
+
+        return (self.bytes_done - self._samples[0][1]) / elapsed
+
+    def _refresh(self, force: bool=False):
+        now = monotonic()
+        interval = self.PLAIN_INTERVAL if self.plain else self.REFRESH
+
+        if not force and now - self._last_refresh < interval:
+            return
+
+        self._last_refresh = now
+
+        speed = self._speed(now)
+        if speed:
+            eta = self._format_time((self.bytes_total - self.bytes_done) / speed)
+        else:
+            eta = '--:--:--'
+
+        files = f'{self.files_done}/{self.files_started} Files'
+        bytes_ = f'{format_bytes(self.bytes_done)}/{format_bytes(self.bytes_total)}'
+        speed = f'{format_bytes(speed)}/s'
+
+        if self.plain:
+            echo(
+                f'[W0b]@ {self.name}:[X] {files}, {bytes_}, '
+                f'{speed}, [W0b]ETA[X] {eta}')
+            return
+
+        if self.bytes_total:
+            filled = int(20 * self.bytes_done / self.bytes_total)
+        else:
+            filled = 0
+
+        bar = '\u2588' * filled + ' ' * (20 - filled)
+
+        lines = [colorize(
+            f'[W0b]{self.name}[X] | {files} | {bytes_} |{bar}| '
+            f'{speed} | [W0b]ETA[X] {eta}'
+        )]
+        active = [t for t in self._active.values() if now - t[3] < self.STALE]
+        active.sort(key=lambda t: t[2], reverse=True)
+
+        for desc, current, total, _ in active[:self.top]:
+            if len(desc) > 32:
+                desc = desc[:29] + '...'
+
+            percent = current / total * 100 if total else 100
+
+            lines.append(
+                f'  {desc:<32} | {percent:3.0f}% | '
+                f'{format_bytes(current)}/{format_bytes(total)}')
+
+        # Bars are made only when needed and never removed
+        # until close, so lines will not jump on redraw
+        while len(self._bars) < len(lines):
+            self._bars.append(self.manager.status_bar(
+                leave=not self._bars, min_delta=0))
+
+        for i, status_bar in enumerate(self._bars):
+            status_bar.update(lines[i] if i < len(lines) else '')
+
+    def close(self):
+        """Will draw the final progress and remove the top lines"""
+        self._refresh(force=True)
+
+        for status_bar in self._bars[1:]:
+            status_bar.close(clear=True)
+
+        if self._bars:
+            self._bars[0].close()
+
 def clear_console():
     """This function will clear user Terminal"""
     if platform_system().lower() == 'windows':
@@ -0,0 +1,485 @@
+"""Tools that schedule and control Box transfers"""
+
+from asyncio import (
+    FIRST_COMPLETED, ensure_future,
+    wait, gather, sleep, Lock
+)
+from typing import (
+    AsyncGenerator, AsyncIterable,
+    Callable, Coroutine, Optional
+)
+from heapq import heappush, heappop
+from inspect import isawaitable
+from itertools import count
+from time import monotonic
+
+from telethon.errors import FloodWaitError
+
+from .terminal import echo
+from .convert import format_bytes
+
+# Max amount of transfers that order_by_size() will hold
+# back to find the largest (or smallest) one among them
+ORDER_LOOKAHEAD = 1000
+
+
+class TransferPool:
+    """
+    This class is a sliding-window pool of transfer
+    coroutines. It is limited by amount of workers and
+    by amount of bytes in flight. Instead of waiting for
+    the whole batch, a new transfer starts the moment any
+    running one is finished and frees its slot & bytes.
+
+    pool = TransferPool(max_workers=5, max_bytes=200000000)
+
+    for file in files:
+        await pool.submit(upload_coroutine(file), file_size)
+    await pool.join()
+
+    If any of transfers raised Exception, it will be
+    re-raised on the next .submit() or .join() call.
+    """
+    def __init__(self, max_workers: int, max_bytes: int):
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+
+        self._tasks = {} # Task -> size in bytes
+        self._bytes = 0
+        self._error = None
+
+        self._waiting = False
+
+    @property
+    def workers(self) -> int:
+        """Amount of transfers in flight"""
+        return len(self._tasks)
+
+    @property
+    def bytes(self) -> int:
+        """Amount of bytes in flight"""
+        return self._bytes
+
+    @property
+    def saturated(self) -> bool:
+        """True if transfer is waiting for a free slot or bytes"""
+        return self._waiting
+
+    def _fits(self, size: int) -> bool:
+        if not self._tasks:
+            # We should always allow at least one transfer, even
+            # if its size is bigger than the max_bytes limit
+            return True
+
+        return len(self._tasks) < self.max_workers\
+            and self._bytes + size <= self.max_bytes
+
+    def _release(self, task):
+        self._bytes -= self._tasks.pop(task)
+
+        if task.cancelled() or self._error:
+            return
+
+        if task.exception():
+            self._error = task.exception()
+
+    def _raise_error(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+    async def submit(self, coroutine: Coroutine, size: int):
+        """
+        Will wait until pool has a free slot and enough
+        bytes for the transfer, then schedule it.
+        """
+        try:
+            while not self._fits(size):
+                self._raise_error()
+
+                self._waiting = True
+                await wait(tuple(self._tasks), return_when=FIRST_COMPLETED)
+
+            self._raise_error()
+        except BaseException:
+            coroutine.close() # Coroutine will be never awaited
+            raise
+        finally:
+            self._waiting = False
+
+        task = ensure_future(coroutine)
+
+        self._tasks[task] = size
+        self._bytes += size
+
+        task.add_done_callback(self._release)
+        return task
+
+    async def join(self):
+        """Will wait until all scheduled transfers are finished"""
+        while self._tasks:
+            self._raise_error()
+            await wait(tuple(self._tasks), return_when=FIRST_COMPLETED)
+
+        self._raise_error()
+
+    async def cancel(self):
+        """Will cancel all transfers that are still in flight"""
+        tasks = tuple(self._tasks)
+
+        for task in tasks:
+            task.cancel()
+
+        await gather(*tasks, return_exceptions=True)
+        self._error = None
+
+
+class RemoteBoxPool:
+    """
+    This class spreads uploads over several accounts
+    that can post to the Box channel. Every account has
+    its own TelegramClient (connection) and RemoteBox,
+    and file is pushed by the account with the least
+    uploads in flight. All files are pushed to the same
+    LocalBox, as it's shared by all RemoteBoxes.
+
+    remote_boxes = RemoteBoxPool(drb, upload_limit)
+    remote_boxes.add(other_drb, other_upload_limit)
+
+    drbf = await remote_boxes.push_file(pf, progress_callback=...)
+    await remote_boxes.close()
+
+    First RemoteBox (of the Box owner) is never closed here.
+    """
+    def __init__(self, drb, upload_limit: int):
+        self._boxes = [] # List of [drb, upload_limit, uploads in flight]
+        self.add(drb, upload_limit)
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def add(self, drb, upload_limit: int):
+        self._boxes.append([drb, upload_limit, 0])
+
+    async def push_file(self, pf, **kwargs):
+        """
+        Will push file by account that has the least uploads
+        in flight and can upload file of such size (accounts
+        without Premium have lower limit). kwargs are for
+        the DecryptedRemoteBox.push_file().
+        """
+        boxes = [box for box in self._boxes if box[1] >= pf.filesize]
+        box = min(boxes or self._boxes[:1], key=lambda box: box[2])
+
+        box[2] += 1
+        try:
+            return await box[0].push_file(pf, **kwargs)
+        finally:
+            box[2] -= 1
+
+    async def close(self):
+        for drb, _, _ in self._boxes[1:]:
+            await drb.done()
+
+
+class AdaptiveLimits:
+    """
+    This class is an AIMD (additive increase, multiplicative
+    decrease) controller of the max_workers and max_bytes.
+
+    Every INTERVAL seconds we measure throughput. If there
+    was a FloodWait or any other error, limits are halved.
+    If the last increase made throughput worse, it will be
+    rolled back. Otherwise, if pools were fully used, we add
+    one worker (and average amount of bytes per worker).
+
+    adaptive = AdaptiveLimits('upload', max_workers=5, max_bytes=200000000)
+    adaptive.attach(pool)
+
+    ... .push_file(..., progress_callback=adaptive.track(callback))
+    adaptive.close()
+
+    All changes are echoed, so user can pin good values.
+    """
+    # Length of one throughput measurement, in seconds
+    INTERVAL = 5
+
+    def __init__(
+            self, name: str, max_workers: int, max_bytes: int,
+            workers_range: tuple=(1, 50),
+            bytes_range: tuple=(1000000, 1000000000)):
+        """
+        Arguments:
+            name: str:
+                Name of the transfer (e.g "upload") for output.
+
+            max_workers: int:
+                Initial limit of transfers in flight.
+
+            max_bytes: int:
+                Initial limit of bytes in flight.
+
+            workers_range: tuple, optional:
+                Min and max values of max_workers. Max
+                value will be raised to max_workers.
+
+            bytes_range: tuple, optional:
+                Min and max values of max_bytes. Max
+                value will be raised to max_bytes.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+
+        # Initial limits are never lowered by the ranges
+        self._workers_range = (workers_range[0], max(workers_range[1], max_workers))
+        self._bytes_range = (bytes_range[0], max(bytes_range[1], max_bytes))
+        self._bytes_step = max(max_bytes // max_workers, bytes_range[0])
+
+        self._pools = []
+
+        self._window_start = monotonic()
+        self._window_bytes = 0
+        self._last_throughput = 0
+        self._last_increased = False
+        self._congested = False
+        # Limits will not be increased before this time
+        self._hold_until = 0
+
+    def attach(self, pool: TransferPool):
+        """Will apply current limits to the pool and manage them"""
+        pool.max_workers = self.max_workers
+        pool.max_bytes = self.max_bytes
+        self._pools.append(pool)
+
+    def track(self, progress_callback: Optional[Callable]=None) -> Callable:
+        """
+        Will wrap progress_callback of one transfer, so we
+        can count transferred bytes. It expects callback
+        to be called with (current, total) bytes.
+        """
+        last_current = 0
+
+        def callback(current, total):
+            nonlocal last_current
+
+            self.report_bytes(current - last_current)
+            last_current = current
+
+            if progress_callback:
+                return progress_callback(current, total)
+
+        return callback
+
+    def report_bytes(self, amount: int):
+        self._window_bytes += amount
+        self._adjust()
+
+    def report_error(self, error: Exception):
+        """
+        Will report that some transfer failed with error. On
+        FloodWaitError we also will not increase limits until
+        its wait is over. Shorter FloodWaits are slept by the
+        Telethon itself, so we see them as throughput drop.
+        """
+        self._congested = True
+
+        if isinstance(error, FloodWaitError):
+            self._hold_until = max(self._hold_until,
+                monotonic() + error.seconds)
+
+        self._adjust()
+
+    def _set(self, max_workers: int, max_bytes: int, reason: str) -> bool:
+        max_workers = min(max(max_workers, self._workers_range[0]), self._workers_range[1])
+        max_bytes = min(max(max_bytes, self._bytes_range[0]), self._bytes_range[1])
+
+        if (max_workers, max_bytes) == (self.max_workers, self.max_bytes):
+            return False
+
+        self.max_workers, self.max_bytes = max_workers, max_bytes
+
+        for pool in self._pools:
+            pool.max_workers = max_workers
+            pool.max_bytes = max_bytes
+
+        echo(
+            f'[C0b]@ Auto {self.name}:[X] [W0b]{max_workers}[X] workers, '
+            f'[W0b]{format_bytes(max_bytes)}[X] in flight ({reason})'
+        )
+        return True
+
+    def _adjust(self):
+        elapsed = monotonic() - self._window_start
+        if elapsed < self.INTERVAL:
+            return
+
+        throughput = self._window_bytes / elapsed
+        throughput_f = f'{format_bytes(throughput)}/s'
+        increased = False
+
+        if self._congested:
+            self._set(
+                self.max_workers // 2, self.max_bytes // 2,
+                'FloodWait or error, decreasing'
+            )
+        elif self._last_increased and throughput < self._last_throughput * 0.9:
+            self._set(
+                self.max_workers - 1, self.max_bytes - self._bytes_step,
+                f'throughput dropped to {throughput_f}, decreasing'
+            )
+        elif monotonic() >= self._hold_until\
+            and all(pool.saturated for pool in self._pools):
+            increased = self._set(
+                self.max_workers + 1, self.max_bytes + self._bytes_step,
+                f'throughput is {throughput_f}, increasing'
+            )
+        self._last_increased = increased
+        self._last_throughput = throughput
+
+        self._window_start = monotonic()
+        self._window_bytes = 0
+        self._congested = False
+
+    def close(self):
+        """Will echo the final limits"""
+        echo(
+            f'[C0b]@ Auto {self.name} finished with[X] '
+            f'[W0b]--max-workers={self.max_workers} '
+            f'--max-bytes={self.max_bytes}[X]'
+        )
+
+
+class RateLimiter:
+    """
+    This class is a token bucket limiter of bytes per second.
+    One limiter should be shared by all transfers of one
+    direction (upload or download), so their total speed
+    will not exceed the rate.
+
+    limiter = RateLimiter(rate=10000000) # 10MB/s
+
+    ... .push_file(..., progress_callback=limiter.track(callback))
+
+    Progress callback is called on every chunk that is sent
+    or received, and transfer will wait on it until bucket
+    has enough tokens. Waiting transfers are served in order.
+    """
+    def __init__(self, rate: int, burst: Optional[int]=None):
+        """
+        Arguments:
+            rate: int:
+                Max amount of bytes per second.
+
+            burst: int, optional:
+                Max amount of bytes that can be transferred
+                at once after idle. Rate (one second) or one
+                chunk (512KB), whichever is bigger, by default.
+        """
+        self.rate = rate
+        self.burst = burst or max(rate, 524288)
+
+        self._tokens = self.burst
+        self._last_refill = monotonic()
+        self._lock = Lock()
+
+    def _refill(self):
+        now = monotonic()
+
+        self._tokens += (now - self._last_refill) * self.rate
+        self._tokens = min(self._tokens, self.burst)
+        self._last_refill = now
+
+    async def consume(self, amount: int):
+        """Will wait until amount of bytes can be transferred"""
+        async with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+            if self._tokens < 0:
+                # We go into debt and sleep until it's paid, so
+                # chunks bigger than the burst are still allowed
+                await sleep(-self._tokens / self.rate)
+                self._refill()
+
+    def track(self, progress_callback: Optional[Callable]=None) -> Callable:
+        """
+        Will wrap progress_callback of one transfer. It expects
+        callback to be called with (current, total) bytes.
+        """
+        last_current = None
+
+        async def callback(current, total):
+            nonlocal last_current
+
+            if last_current is None:
+                # On the first call we don't know how much was
+                # transferred before (e.g on download with the
+                # offset), so we charge only one chunk.
+                amount = min(current, 524288)
+            else:
+                amount = current - last_current
+
+            last_current = current
+            await self.consume(amount)
+
+            if progress_callback:
+                r = progress_callback(current, total)
+                if isawaitable(r):
+                    await r
+
+        return callback
+
+    def limit_client(self, client):
+        """
+        Will limit file bytes received by the TelegramClient.
+        This is for operations where we can't count bytes in
+        progress callback (e.g box-clone, which downloads
+        Metadata of every file in Box).
+        """
+        client_call = client._call
+
+        async def _call(sender, request, *args, **kwargs):
+            result = await client_call(sender, request, *args, **kwargs)
+
+            # upload.File and upload.CdnFile results have .bytes
+            if isinstance(getattr(result, 'bytes', None), bytes):
+                await self.consume(len(result.bytes))
+
+            return result
+
+        client._call = _call
+
+async def order_by_size(
+        items: AsyncIterable, size: Callable,
+        largest_first: bool=True, lookahead: int=ORDER_LOOKAHEAD
+        ) -> AsyncGenerator:
+    """
+    This generator will reorder items by size(item), so
+    transfers can be started from the largest (to not end
+    batch with one huge file while other workers are idle)
+    or from the smallest (to get fast feedback).
+
+    We keep only lookahead items in memory and yield the
+    best of them when next item comes, so order is exact
+    only within this window. Items for which size() is
+    None (e.g directories) are yielded immediately.
+    """
+    heap, counter = [], count() # Counter will keep order of equal sizes
+
+    async for item in items:
+        item_size = size(item)
+
+        if item_size is None:
+            yield item
+            continue
+
+        item_size = -item_size if largest_first else item_size
+        heappush(heap, (item_size, next(counter), item))
+
+        if len(heap) > lookahead:
+            yield heappop(heap)[2]
+
+    while heap:
+        yield heappop(heap)[2]
+
@@ -0,0 +1,338 @@
+"""Tools that walk over local file trees"""
+
+from asyncio import (
+    FIRST_COMPLETED, get_running_loop, wait
+)
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    AsyncGenerator, Callable, Iterable,
+    NamedTuple, Optional
+)
+from collections import deque
+from functools import partial
+from errno import EACCES
+from pathlib import Path
+from re import compile as re_compile, escape as re_escape
+
+from os import (
+    scandir, stat, lstat, access,
+    stat_result, R_OK, sep
+)
+from stat import S_ISDIR
+from os.path import join as path_join
+
+# Default amount of threads that will scan directories
+# at the same time. Scan is mostly waiting for the FS
+# (especially if it's a network one), not for the CPU
+WALK_WORKERS = 8
+
+# Name of the file with gitignore-style patterns. It
+# will be read from the root of every target directory
+IGNORE_FILE = '.tgboxignore'
+
+
+class WalkEntry(NamedTuple):
+    """
+    Single result of the walk_tree(). If error is not None
+    then path is not readable and stat is None. stat is
+    also None for directories, as we don't need it.
+    """
+    path: Path
+    is_dir: bool
+    stat: Optional[stat_result]
+    error: Optional[OSError]
+
+class IgnoreMatcher:
+    """
+    This class is a matcher of gitignore-style patterns. All
+    patterns are compiled to regex once, on init. Supported
+    syntax (same as in .gitignore):
+
+        # comment      Line is ignored (use "\\#" for "#")
+        name           Matches file or dir "name" at any level
+        dir/           Matches only directories
+        a/b            Pattern with "/" is relative to the root
+        *, ?, [a-z]    Wildcards; they never match "/"
+        **/a, a/**     Any amount of directories
+        !pattern       Re-include path excluded before
+
+    As in git, the last matched pattern wins. Paths inside
+    ignored directory can't be re-included, because it
+    will not be walked into at all.
+
+    ignore = IgnoreMatcher(['*.tmp', 'node_modules/', '!keep.tmp'])
+    ignore('src/node_modules', is_dir=True) # True
+    """
+    def __init__(self, patterns: Iterable[str]=()):
+        # List of (match_func, negate, dir_only, anchored)
+        self._rules = []
+
+        for pattern in patterns:
+            rule = self._compile(pattern)
+            if rule:
+                self._rules.append(rule)
+
+    @classmethod
+    def from_file(cls, file_path: Path) -> 'IgnoreMatcher':
+        """Will make IgnoreMatcher from file (if exists)"""
+        try:
+            with open(file_path, encoding='utf-8') as file:
+                return cls(file.read().splitlines())
+        except FileNotFoundError:
+            return cls()
+
+    @staticmethod
+    def _compile(pattern: str) -> Optional[tuple]:
+        if pattern.endswith('\\ '):
+            pattern = pattern[:-2] + ' '
+        else:
+            pattern = pattern.rstrip(' ')
+
+        if not pattern or pattern.startswith('#'):
+            return None
+
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+
+        elif pattern.startswith(('\\!', '\\#')):
+            pattern = pattern[1:]
+
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+
+        if not pattern:
+            return None
+
+        regex, i = '', 0
+        while i < len(pattern):
+            char = pattern[i]
+
+            if pattern.startswith('**/', i):
+                regex += '(?:.*/)?'; i += 3
+                continue
+
+            if pattern.startswith('**', i):
+                regex += '.*'; i += 2
+                continue
+
+            if char == '*':
+                regex += '[^/]*'
+
+            elif char == '?':
+                regex += '[^/]'
+
+            elif char == '[' and pattern.find(']', i + 2) != -1:
+                end = pattern.find(']', i + 2)
+                chars = pattern[i+1:end].replace('\\', '\\\\')
+
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+
+                regex += f'[{chars}]'; i = end + 1
+                continue
+
+            elif char == '\\' and i + 1 < len(pattern):
+                regex += re_escape(pattern[i+1]); i += 2
+                continue
+            else:
+                regex += re_escape(char)
+
+            i += 1
+
+        return (re_compile(regex).fullmatch, negate, dir_only, anchored)
+
+    def __add__(self, other: 'IgnoreMatcher') -> 'IgnoreMatcher':
+        """Patterns of other will follow (and override) ours"""
+        matcher = IgnoreMatcher()
+        matcher._rules = self._rules + other._rules
+        return matcher
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def __call__(self, rel_path: str, is_dir: bool) -> bool:
+        """
+        Will return True if path (relative to the root
+        and separated by "/") should be ignored.
+        """
+        name = rel_path.rsplit('/', 1)[-1]
+
+        for match, negate, dir_only, anchored in reversed(self._rules):
+            if dir_only and not is_dir:
+                continue
+
+            if match(rel_path if anchored else name):
+                return not negate
+
+        return False
+
+def _file_entry(path: str, stat_func: Callable) -> WalkEntry:
+    try:
+        file_stat = stat_func()
+        # Much cheaper than open() but will tell the same
+        if not access(path, R_OK):
+            raise PermissionError(EACCES, 'Permission denied', path)
+    except OSError as e:
+        return WalkEntry(Path(path), False, None, e)
+
+    return WalkEntry(Path(path), False, file_stat, None)
+
+def _scan_dir(
+        path: Path, root_prefix: str,
+        ignore: Optional[IgnoreMatcher]) -> tuple:
+    """
+    Will scan one directory and return its entries and a
+    list of sub-directories to scan. We reuse DirEntry
+    type & stat, so there is at most one stat() call
+    per file and none per directory (on most systems).
+
+    Entries matched by ignore are dropped here, before
+    any stat() call, so ignored directories are never
+    scanned at all.
+    """
+    entries, subdirs = [], []
+    try:
+        with scandir(path) as dir_iter:
+            for entry in dir_iter:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if ignore:
+                    rel_path = entry.path[len(root_prefix):]
+                    if sep != '/':
+                        rel_path = rel_path.replace(sep, '/')
+
+                    if ignore(rel_path, is_dir):
+                        continue
+
+                if is_dir:
+                    entries.append(WalkEntry(Path(entry.path), True, None, None))
+                    # Same as Path.rglob(), we don't follow symlinks
+                    # to directories, so we will not walk in circles
+                    if not entry.is_symlink():
+                        subdirs.append(Path(entry.path))
+                else:
+                    entries.append(_file_entry(entry.path, entry.stat))
+
+    except OSError as e:
+        return [WalkEntry(path, True, None, e)], []
+
+    return entries, subdirs
+
+async def walk_tree(
+        path: Path, max_workers: int=WALK_WORKERS,
+        ignore: Optional[IgnoreMatcher]=None,
+        root: Optional[Path]=None
+        ) -> AsyncGenerator[WalkEntry, None]:
+    """
+    This generator will recursively walk over the path
+    and yield WalkEntry for every file and directory in
+    it (or only for path itself if it's a file).
+
+    Directories are scanned in parallel on a thread
+    pool, and results are yielded as soon as any of
+    directories is scanned, so caller can start work
+    on files without waiting for the whole tree.
+    Order of results is therefore not defined.
+
+    If ignore is specified, matched files and directories
+    (relative to the root, path by default) will be
+    silently skipped.
+    """
+    loop = get_running_loop()
+
+    if not path.is_dir():
+        yield await loop.run_in_executor(
+            None, _file_entry, str(path), partial(stat, path))
+        return
+
+    root_prefix = path_join(str(root or path), '')
+    scan_dir = partial(_scan_dir, root_prefix=root_prefix, ignore=ignore)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending, running = deque((path,)), set()
+    try:
+        while pending or running:
+            # We limit amount of scans in flight, so results
+            # will not pile up in memory if caller is slow
+            while pending and len(running) < max_workers:
+                running.add(loop.run_in_executor(
+                    executor, scan_dir, pending.popleft()))
+
+            done, running = await wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                entries, subdirs = future.result()
+                pending.extend(subdirs)
+
+                for entry in entries:
+                    yield entry
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def walk_paths(
+        path: Path, paths: Iterable[Path],
+        ignore: Optional[IgnoreMatcher]=None
+        ) -> AsyncGenerator[WalkEntry, None]:
+    """
+    This generator is the same as walk_tree(), but will
+    yield WalkEntry only for the specified paths inside
+    of the path (e.g files that were changed). Specified
+    directories are walked recursively, and paths that
+    are not exist anymore are silently skipped.
+    """
+    loop = get_running_loop()
+
+    path_is_dir = path.is_dir()
+    root_prefix = path_join(str(path), '')
+
+    walked_dirs = set()
+
+    # Parents are sorted before their children, so we will
+    # not yield files of directory that we already walked
+    for current_path in sorted(set(paths)):
+        if not path_is_dir:
+            if current_path != path:
+                continue
+
+        elif not str(current_path).startswith(root_prefix):
+            continue
+
+        if walked_dirs.intersection(current_path.parents):
+            continue
+        try:
+            current_stat = await loop.run_in_executor(None, lstat, current_path)
+        except FileNotFoundError:
+            continue # Was removed after change
+        except OSError as e:
+            yield WalkEntry(current_path, False, None, e)
+            continue
+
+        is_dir = S_ISDIR(current_stat.st_mode)
+
+        if ignore and path_is_dir:
+            rel_path = str(current_path)[len(root_prefix):]
+            if sep != '/':
+                rel_path = rel_path.replace(sep, '/')
+
+            # Path is ignored if any of its parent directories is
+            rel_parts = rel_path.split('/')
+            if any(ignore('/'.join(rel_parts[:i]), True) for i in range(1, len(rel_parts)))\
+                or ignore(rel_path, is_dir):
+                    continue
+
+        if is_dir:
+            walked_dirs.add(current_path)
+            yield WalkEntry(current_path, True, None, None)
+
+            async for entry in walk_tree(current_path, ignore=ignore, root=path):
+                yield entry
+        else:
+            yield await loop.run_in_executor(None, _file_entry,
+                str(current_path), partial(stat, current_path))
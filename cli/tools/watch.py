@@ -0,0 +1,268 @@
+"""Tools that watch local file trees for changes"""
+
+from asyncio import (
+    get_running_loop, wait_for,
+    Event, TimeoutError as WaitTimeout
+)
+from typing import Optional
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from errno import ENOSPC
+from pathlib import Path
+from struct import calcsize, unpack_from
+from threading import Lock
+from time import monotonic
+
+from os import (
+    scandir, read, close,
+    fsencode, fsdecode, sep
+)
+from os.path import join as path_join
+
+from .walk import IgnoreMatcher
+
+# Flags and event masks from the <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# We don't care about removed files, only about new and
+# changed ones. IN_MODIFY is here only for debounce, so
+# files that are still being written will not be reported
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    | IN_ONLYDIR | IN_DONT_FOLLOW
+)
+# struct inotify_event without the name
+EVENT_FORMAT = 'iIII'
+EVENT_SIZE = calcsize(EVENT_FORMAT)
+
+
+class TreeWatcher:
+    """
+    This class watches directory trees for created and
+    modified files with the Linux inotify. It's called
+    directly from the libc, so there are no additional
+    dependencies, but it's not available on other OS.
+
+    Events are debounced: path is reported only after
+    DEBOUNCE seconds without any new events on it, so
+    files that are still being written are not reported
+    and many events on one file are coalesced to one.
+
+    watcher = TreeWatcher()
+    if watcher.start():
+        await watcher.watch(Path('/home/user/Documents'))
+
+        while True:
+            changed = await watcher.changes(timeout=600)
+            ...
+    watcher.close()
+
+    changes() will return None if some events were lost
+    (e.g on kernel queue overflow). Caller should rescan
+    watched trees then.
+
+    Trees are scanned in the executor, so watches are
+    accessed under the lock.
+    """
+    # Seconds without events on path before it's reported
+    DEBOUNCE = 2
+
+    def __init__(self):
+        self._libc = None
+        self._loop = None
+        self._fd = None
+
+        self._watches = {} # Watch descriptor -> (dir Path, root Path, ignore)
+        self._watches_lock = Lock()
+        self._adding = set() # Futures of _add_tree() for new directories
+
+        self._pending = {} # Path -> monotonic() time of the last event
+
+        self._event = None
+        self._lost = False
+
+        self.limited = False
+
+    @property
+    def watching(self) -> bool:
+        return self._fd is not None
+
+    def start(self) -> bool:
+        """Will return False if inotify is not available"""
+        try:
+            self._libc = CDLL(find_library('c'), use_errno=True)
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return False # Not a Linux
+
+        if fd < 0:
+            return False
+
+        self._fd = fd
+        self._event = Event()
+
+        self._loop = get_running_loop()
+        self._loop.add_reader(self._fd, self._read_events)
+        return True
+
+    async def watch(self, root: Path, ignore: Optional[IgnoreMatcher]=None):
+        """
+        Will watch root directory and all of its sub-directories,
+        except ones matched by ignore (relative to the root).
+        New directories will be watched as they are created.
+
+        If limit of inotify watches was reached, the limited
+        attribute will be set to True. Files in directories
+        that are not watched will be found only on rescan.
+        """
+        await self._loop.run_in_executor(
+            None, self._add_tree, root, root, ignore)
+
+    def _add_tree(self, path: Path, root: Path, ignore: Optional[IgnoreMatcher]):
+        root_prefix = path_join(str(root), '')
+        pending = [path]
+
+        while pending:
+            current_dir = pending.pop()
+
+            if ignore and current_dir != root:
+                rel_path = str(current_dir)[len(root_prefix):]
+                if sep != '/':
+                    rel_path = rel_path.replace(sep, '/')
+
+                if ignore(rel_path, True):
+                    continue
+
+            with self._watches_lock:
+                if self._fd is None: # Watcher was closed
+                    return
+
+                wd = self._libc.inotify_add_watch(
+                    self._fd, fsencode(current_dir), WATCH_MASK)
+
+                if wd >= 0:
+                    self._watches[wd] = (current_dir, root, ignore)
+
+            if wd < 0:
+                if get_errno() == ENOSPC:
+                    self.limited = True
+                continue # Directory was removed or not readable
+            try:
+                with scandir(current_dir) as dir_iter:
+                    for entry in dir_iter:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(Path(entry.path))
+            except OSError:
+                continue
+
+    def _read_events(self):
+        try:
+            data = read(self._fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = unpack_from(EVENT_FORMAT, data, offset)
+            offset += EVENT_SIZE
+
+            name = data[offset:offset+name_len].rstrip(b'\0')
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                self._lost = True
+                continue
+
+            with self._watches_lock:
+                if mask & IN_IGNORED: # Directory was removed
+                    self._watches.pop(wd, None)
+                    continue
+
+                watch = self._watches.get(wd)
+
+            if not watch or not name:
+                continue
+
+            path = watch[0] / fsdecode(name)
+
+            if mask & IN_ISDIR:
+                if not mask & (IN_CREATE | IN_MOVED_TO):
+                    continue
+
+                # Files can be created in new directory before we
+                # watch it, so the whole directory is reported. It
+                # can be big (e.g moved in), so we scan it as watch()
+                adding = self._loop.run_in_executor(
+                    None, self._add_tree, path, watch[1], watch[2])
+
+                self._adding.add(adding)
+                adding.add_done_callback(self._adding.discard)
+
+            self._pending[path] = monotonic()
+
+        self._event.set()
+
+    async def changes(self, timeout: float) -> Optional[set]:
+        """
+        Will wait up to timeout seconds for changed paths
+        and return them. Set will be empty if there were
+        no changes and None if some events were lost.
+        """
+        deadline = monotonic() + timeout
+
+        while True:
+            if self._lost:
+                self._lost = False
+                self._pending.clear()
+                return None
+
+            now = monotonic()
+            changed = {
+                path for path, last_event in self._pending.items()
+                if now - last_event >= self.DEBOUNCE
+            }
+            if changed:
+                for path in changed:
+                    del self._pending[path]
+                return changed
+
+            if now >= deadline:
+                return set()
+
+            wait_time = deadline - now
+
+            if self._pending:
+                nearest = min(self._pending.values()) + self.DEBOUNCE
+                wait_time = min(wait_time, nearest - now)
+
+            self._event.clear()
+            try:
+                await wait_for(self._event.wait(), wait_time)
+            except WaitTimeout:
+                pass
+
+    def close(self):
+        if self._fd is None:
+            return
+
+        self._loop.remove_reader(self._fd)
+
+        for adding in self._adding:
+            adding.cancel()
+
+        with self._watches_lock:
+            close(self._fd)
+
+            self._fd = None
+            self._watches.clear()
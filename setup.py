@@ -25,12 +25,14 @@ setup(
     include_package_data = True,
 
     install_requires=[
-        'tgbox<2',
+        # SenderPool (cli/tools/connections.py) relies
+        # on the private tgbox.fastelethon internals
+        'tgbox>=1.6,<1.7',
         'click==8.3.1',
         'enlighten==1.14.1'
     ],
     extras_require={
-        'fast': ['tgbox[fast]<2']
+        'fast': ['tgbox[fast]>=1.6,<1.7']
     },
     keywords = [
         'Telegram', 'Cloud-Storage',